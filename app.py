@@ -1,13 +1,20 @@
 from flask import Flask, render_template, request, jsonify, session
 from flask_cors import CORS
 import os
-import json
 import uuid
-from datetime import datetime
+import time
+import hashlib
+from datetime import datetime, timezone
+from functools import lru_cache
 import redis
+import msgspec
 from dotenv import load_dotenv
 import logging
+import threading
+from types import MappingProxyType
 from typing import Dict, Any, Optional, List
+from cachetools import LRUCache, TTLCache
+from utils.session_manager import decode_preferences
 
 # Load environment variables
 load_dotenv()
@@ -16,8 +23,8 @@ app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
 CORS(app)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (set LOG_LEVEL=WARNING in production to silence per-request lines)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 # Redis connection with fallback
@@ -31,59 +38,94 @@ try:
         logger.warning("REDIS_URL not found, Redis disabled")
         redis_client = None
 except Exception as e:
-    logger.error(f"Redis connection failed: {e}")
+    logger.error("Redis connection failed: %s", e)
     redis_client = None
 
+@lru_cache(maxsize=1)
+def _format_utc_second(epoch_second: int) -> str:
+    return datetime.fromtimestamp(epoch_second, timezone.utc).isoformat()
+
+def utc_timestamp() -> str:
+    """Current UTC time as ISO-8601, formatted at most once per second"""
+    return _format_utc_second(int(time.time()))
+
+# Store a session's preferences and announce them on a channel in one atomic round-trip
+STORE_AND_PUBLISH_SCRIPT = """
+redis.call('SETEX', KEYS[1], ARGV[1], ARGV[2])
+redis.call('PUBLISH', ARGV[3], ARGV[4])
+return 1
+"""
+
 class SessionManager:
     def __init__(self, redis_client):
         self.redis_client = redis_client
         self.session_expiry = 3600
         self.in_memory_store = {}
+        self.store_and_publish = redis_client.register_script(STORE_AND_PUBLISH_SCRIPT) if redis_client else None
+        # Recently read preferences, so repeat prompt requests skip the Redis round-trip
+        self.preferences_cache = TTLCache(maxsize=1024, ttl=60)
+        self.preferences_cache_lock = threading.Lock()
     
-    def store_preferences(self, session_id: str, preferences: Dict[str, Any]) -> bool:
+    def store_preferences(self, session_id: str, preferences: Dict[str, Any], publish_channel: Optional[str] = None) -> bool:
         try:
-            preferences['stored_at'] = datetime.utcnow().isoformat()
+            # Unix seconds; cheaper to produce and smaller on the wire than ISO-8601
+            preferences['stored_at'] = int(time.time())
             
             if self.redis_client:
                 key = f"preferences:{session_id}"
-                self.redis_client.setex(key, self.session_expiry, json.dumps(preferences))
-                logger.info(f"Preferences stored in Redis for session: {session_id}")
+                if publish_channel:
+                    self.store_and_publish(
+                        keys=[key],
+                        args=[self.session_expiry, msgspec.msgpack.encode(preferences), publish_channel, session_id]
+                    )
+                else:
+                    self.redis_client.setex(key, self.session_expiry, msgspec.msgpack.encode(preferences))
+                with self.preferences_cache_lock:
+                    self.preferences_cache.pop(session_id, None)
+                logger.info("Preferences stored in Redis for session: %s", session_id)
             else:
                 self.in_memory_store[session_id] = {
                     'data': preferences,
-                    'expires_at': datetime.utcnow().timestamp() + self.session_expiry
+                    'expires_at': time.time() + self.session_expiry
                 }
-                logger.info(f"Preferences stored in memory for session: {session_id}")
+                logger.info("Preferences stored in memory for session: %s", session_id)
             
             return True
         except Exception as e:
-            logger.error(f"Error storing preferences: {e}")
+            logger.error("Error storing preferences: %s", e)
             return False
     
     def get_preferences(self, session_id: str) -> Optional[Dict[str, Any]]:
         try:
             if self.redis_client:
+                with self.preferences_cache_lock:
+                    cached = self.preferences_cache.get(session_id)
+                if cached is not None:
+                    return cached
+                
                 key = f"preferences:{session_id}"
                 stored_data = self.redis_client.get(key)
                 if stored_data:
-                    return json.loads(stored_data)
+                    preferences = decode_preferences(stored_data)
+                    with self.preferences_cache_lock:
+                        self.preferences_cache[session_id] = preferences
+                    return preferences
             else:
                 if session_id in self.in_memory_store:
                     stored_item = self.in_memory_store[session_id]
-                    if datetime.utcnow().timestamp() > stored_item['expires_at']:
+                    if time.time() > stored_item['expires_at']:
                         del self.in_memory_store[session_id]
                         return None
                     return stored_item['data']
             return None
         except Exception as e:
-            logger.error(f"Error retrieving preferences: {e}")
+            logger.error("Error retrieving preferences: %s", e)
             return None
 
 class PreferenceValidator:
-    def __init__(self):
-        self.valid_genres = ['pop', 'rock', 'electronic', 'hip-hop', 'jazz', 'classical', 'country', 'folk', 'reggae', 'blues', 'funk', 'lofi', 'ambient']
-        self.valid_moods = ['upbeat', 'relaxed', 'energetic', 'melancholic', 'happy', 'sad', 'angry', 'peaceful', 'dramatic', 'mysterious', 'romantic']
-        self.valid_tempos = ['slow', 'medium', 'fast', 'very_fast']
+    valid_genres = frozenset({'pop', 'rock', 'electronic', 'hip-hop', 'jazz', 'classical', 'country', 'folk', 'reggae', 'blues', 'funk', 'lofi', 'ambient'})
+    valid_moods = frozenset({'upbeat', 'relaxed', 'energetic', 'melancholic', 'happy', 'sad', 'angry', 'peaceful', 'dramatic', 'mysterious', 'romantic'})
+    valid_tempos = frozenset({'slow', 'medium', 'fast', 'very_fast'})
     
     def validate_preferences(self, data: Dict[str, Any]) -> Dict[str, Any]:
         errors = []
@@ -103,27 +145,57 @@ class PreferenceValidator:
         
         return {'valid': len(errors) == 0, 'errors': errors}
 
+# Preset configurations, shared read-only by every processor instance
+PRESETS = MappingProxyType({
+    name: MappingProxyType(preset) for name, preset in {
+        'energetic_pop': {
+            'genre': 'pop', 'mood': 'upbeat', 'tempo': 'fast', 'energy_level': 'high',
+            'visual_style': 'modern', 'color_scheme': 'vibrant'
+        },
+        'chill_lofi': {
+            'genre': 'lofi', 'mood': 'relaxed', 'tempo': 'slow', 'energy_level': 'low',
+            'visual_style': 'minimal', 'color_scheme': 'pastel'
+        },
+        'rock_anthem': {
+            'genre': 'rock', 'mood': 'powerful', 'tempo': 'fast', 'energy_level': 'high',
+            'visual_style': 'bold', 'color_scheme': 'dark'
+        }
+    }.items()
+})
+
+# The /api/presets body never changes, so it is encoded once
+PRESETS_RESPONSE = msgspec.json.encode({
+    'success': True,
+    'presets': {name: dict(preset) for name, preset in PRESETS.items()}
+})
+
+# Deterministic key order so equal form submissions hash to the same key
+_preferences_key_encoder = msgspec.msgpack.Encoder(order='deterministic')
+
 class PreferenceProcessor:
     def __init__(self):
-        self.presets = {
-            'energetic_pop': {
-                'genre': 'pop', 'mood': 'upbeat', 'tempo': 'fast', 'energy_level': 'high',
-                'visual_style': 'modern', 'color_scheme': 'vibrant'
-            },
-            'chill_lofi': {
-                'genre': 'lofi', 'mood': 'relaxed', 'tempo': 'slow', 'energy_level': 'low',
-                'visual_style': 'minimal', 'color_scheme': 'pastel'
-            },
-            'rock_anthem': {
-                'genre': 'rock', 'mood': 'powerful', 'tempo': 'fast', 'energy_level': 'high',
-                'visual_style': 'bold', 'color_scheme': 'dark'
-            }
-        }
+        # Structured sections for recent inputs; re-submits and retries repeat the same form data
+        self.sections_cache = LRUCache(maxsize=512)
+        self.sections_cache_lock = threading.Lock()
+        self.presets = PRESETS
     
     def process_preferences(self, raw_data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
+        key = hashlib.blake2b(_preferences_key_encoder.encode(raw_data), digest_size=16).digest()
+        with self.sections_cache_lock:
+            sections = self.sections_cache.get(key)
+        if sections is None:
+            sections = self._build_sections(raw_data)
+            with self.sections_cache_lock:
+                self.sections_cache[key] = sections
+        
         return {
             'session_id': session_id,
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': utc_timestamp(),
+            **sections
+        }
+    
+    def _build_sections(self, raw_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
             'music_preferences': {
                 'genre': raw_data.get('genre', 'pop'),
                 'mood': raw_data.get('mood', 'upbeat'),
@@ -156,7 +228,28 @@ from services.gemini_service import GeminiService
 session_manager = SessionManager(redis_client)
 validator = PreferenceValidator()
 processor = PreferenceProcessor()
-gemini_service = GeminiService()
+gemini_service = GeminiService(redis_client)
+gemini_service.warm_up()
+
+def get_json_body() -> Any:
+    """Decode the JSON request body with msgspec without caching the raw bytes on the request"""
+    raw_body = request.get_data(cache=False)
+    if not raw_body:
+        return {}
+    return msgspec.json.decode(raw_body)
+
+def read_phase2_status(session_id: str) -> Optional[Dict[str, Any]]:
+    """Read the Phase 2 status hash written by the music worker"""
+    status_data = redis_client.hgetall(f"phase2_status:{session_id}")
+    if not status_data:
+        return None
+    
+    status = {key.decode('utf-8'): value.decode('utf-8') for key, value in status_data.items()}
+    status.setdefault('phase', 2)
+    for numeric_field in ('phase', 'songs_count'):
+        if numeric_field in status:
+            status[numeric_field] = int(status[numeric_field])
+    return status
 
 @app.route('/')
 def index():
@@ -170,7 +263,7 @@ def test_phase3():
 def health_check():
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat(),
+        'timestamp': utc_timestamp(),
         'redis_connected': redis_client is not None,
         'gemini_configured': gemini_service.model is not None
     })
@@ -178,7 +271,7 @@ def health_check():
 @app.route('/api/preferences', methods=['POST'])
 def submit_preferences():
     try:
-        data = request.get_json()
+        data = get_json_body()
         
         validation_result = validator.validate_preferences(data)
         if not validation_result['valid']:
@@ -191,17 +284,15 @@ def submit_preferences():
         processed_data = processor.process_preferences(data, session_id)
         
         if redis_client:
-            session_manager.store_preferences(session_id, processed_data)
+            # Storing and signalling Phase 2 happen in the same Redis call
+            if session_manager.store_preferences(session_id, processed_data, publish_channel='phase1_completed'):
+                logger.info("Phase 1 completed signal sent for session: %s", session_id)
         else:
             session[session_id] = processed_data
         
         session['session_id'] = session_id
         
-        logger.info(f"Preferences stored for session: {session_id}")
-        
-        if redis_client:
-            redis_client.publish('phase1_completed', session_id)
-            logger.info(f"Phase 1 completed signal sent for session: {session_id}")
+        logger.info("Preferences stored for session: %s", session_id)
         
         return jsonify({
             'success': True,
@@ -211,7 +302,7 @@ def submit_preferences():
         })
         
     except Exception as e:
-        logger.error(f"Error in submit_preferences: {e}")
+        logger.error("Error in submit_preferences: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -239,7 +330,7 @@ def get_preferences(session_id):
         })
         
     except Exception as e:
-        logger.error(f"Error retrieving preferences: {e}")
+        logger.error("Error retrieving preferences: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -247,16 +338,12 @@ def get_preferences(session_id):
 
 @app.route('/api/presets')
 def get_presets():
-    presets = processor.get_presets()
-    return jsonify({
-        'success': True,
-        'presets': presets
-    })
+    return app.response_class(PRESETS_RESPONSE, mimetype='application/json')
 
 @app.route('/api/enhance-image-prompt', methods=['POST'])
 def enhance_image_prompt():
     try:
-        data = request.get_json()
+        data = get_json_body()
         user_prompt = data.get('prompt', '')
         session_id = data.get('session_id', '')
         
@@ -277,7 +364,7 @@ def enhance_image_prompt():
         return jsonify(result)
         
     except Exception as e:
-        logger.error(f"Error in enhance_image_prompt: {e}")
+        logger.error("Error in enhance_image_prompt: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -286,7 +373,7 @@ def enhance_image_prompt():
 @app.route('/api/image-suggestions', methods=['POST'])
 def get_image_suggestions():
     try:
-        data = request.get_json()
+        data = get_json_body()
         session_id = data.get('session_id', '')
         temp_preferences = data.get('preferences', {})
         
@@ -309,7 +396,7 @@ def get_image_suggestions():
         return jsonify(result)
         
     except Exception as e:
-        logger.error(f"Error in get_image_suggestions: {e}")
+        logger.error("Error in get_image_suggestions: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -318,7 +405,7 @@ def get_image_suggestions():
 @app.route('/api/enhance-music-prompt', methods=['POST'])
 def enhance_music_prompt():
     try:
-        data = request.get_json()
+        data = get_json_body()
         user_prompt = data.get('prompt', '')
         session_id = data.get('session_id', '')
         
@@ -339,7 +426,7 @@ def enhance_music_prompt():
         return jsonify(result)
         
     except Exception as e:
-        logger.error(f"Error in enhance_music_prompt: {e}")
+        logger.error("Error in enhance_music_prompt: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -375,12 +462,12 @@ def generate_music_direct(session_id):
         else:
             # Store in Redis
             results_key = f"phase2_results:{session_id}"
-            redis_client.setex(results_key, 3600, json.dumps(result))
+            redis_client.setex(results_key, 3600, msgspec.json.encode(result))
         
         return jsonify(result)
         
     except Exception as e:
-        logger.error(f"Error in direct music generation: {e}")
+        logger.error("Error in direct music generation: %s", e)
         return jsonify({
             'success': False,
             'error': f'Music generation failed: {str(e)}'
@@ -408,23 +495,21 @@ def get_phase2_status(session_id):
                     'error': 'Redis not available and no music results found'
                 }), 500
         
-        status_key = f"phase2_status:{session_id}"
-        status_data = redis_client.get(status_key)
+        status = read_phase2_status(session_id)
         
-        if not status_data:
+        if not status:
             return jsonify({
                 'success': False,
                 'error': 'Session not found or expired'
             }), 404
         
-        status = json.loads(status_data)
         return jsonify({
             'success': True,
             'status': status
         })
         
     except Exception as e:
-        logger.error(f"Error getting Phase 2 status: {e}")
+        logger.error("Error getting Phase 2 status: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -449,14 +534,14 @@ def get_phase2_results(session_id):
                 'error': 'Results not found or expired'
             }), 404
         
-        results = json.loads(results_data)
+        results = msgspec.json.decode(results_data)
         return jsonify({
             'success': True,
             'results': results
         })
         
     except Exception as e:
-        logger.error(f"Error getting Phase 2 results: {e}")
+        logger.error("Error getting Phase 2 results: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -501,7 +586,7 @@ def get_phase3_status(session_id):
         return jsonify(response_data)
         
     except Exception as e:
-        logger.error(f"Error getting Phase 3 status: {e}")
+        logger.error("Error getting Phase 3 status: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -511,24 +596,29 @@ def get_phase3_status(session_id):
 def suno_callback():
     """Handle Suno API callback when music generation is complete"""
     try:
-        data = request.get_json()
-        logger.info(f"Received Suno callback: {data}")
+        data = get_json_body()
         
         # Extract session info from the callback data
         task_id = data.get('taskId')
         status = data.get('status')
+        logger.info("Received Suno callback for task %s (status: %s)", task_id, status)
+        logger.debug("Suno callback payload: %s", data)
         
         if status == 'complete' and task_id:
             # Update Redis with completion status
             if redis_client:
-                callback_key = f"suno_callback:{task_id}"
-                redis_client.setex(callback_key, 3600, json.dumps(data))
-                logger.info(f"Stored Suno callback for task: {task_id}")
+                # Phase 2 blocks on this list with BLPOP instead of polling for it
+                callback_key = f"suno:done:{task_id}"
+                with redis_client.pipeline(transaction=False) as pipe:
+                    pipe.lpush(callback_key, msgspec.json.encode(data))
+                    pipe.expire(callback_key, 3600)
+                    pipe.execute()
+                logger.info("Stored Suno callback for task: %s", task_id)
         
         return jsonify({'success': True, 'message': 'Callback received'}), 200
         
     except Exception as e:
-        logger.error(f"Error handling Suno callback: {e}")
+        logger.error("Error handling Suno callback: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/phase3/results/<session_id>', methods=['GET'])
@@ -550,14 +640,14 @@ def get_phase3_results(session_id):
                 'error': 'Video results not found or not ready'
             }), 404
         
-        results = json.loads(results_data.decode('utf-8') if isinstance(results_data, bytes) else results_data)
+        results = msgspec.json.decode(results_data)
         return jsonify({
             'success': True,
             'results': results
         })
         
     except Exception as e:
-        logger.error(f"Error getting Phase 3 results: {e}")
+        logger.error("Error getting Phase 3 results: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -573,7 +663,7 @@ def download_music_files(session_id):
             results_key = f"phase2_results:{session_id}"
             results_data = redis_client.get(results_key)
             if results_data:
-                music_results = json.loads(results_data)
+                music_results = msgspec.json.decode(results_data)
         else:
             music_results = session.get(f'music_results_{session_id}')
         
@@ -607,7 +697,7 @@ def download_music_files(session_id):
         })
         
     except Exception as e:
-        logger.error(f"Error getting download links: {e}")
+        logger.error("Error getting download links: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -628,9 +718,7 @@ def get_complete_session_status(session_id):
         phase1_complete = preferences is not None
         
         # Get Phase 2 status
-        phase2_status_key = f"phase2_status:{session_id}"
-        phase2_status_data = redis_client.get(phase2_status_key)
-        phase2_status = json.loads(phase2_status_data) if phase2_status_data else None
+        phase2_status = read_phase2_status(session_id)
         
         # Get Phase 3 status
         session_key = f"session:{session_id}"
@@ -658,7 +746,7 @@ def get_complete_session_status(session_id):
         return jsonify(response)
         
     except Exception as e:
-        logger.error(f"Error getting complete session status: {e}")
+        logger.error("Error getting complete session status: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -8,9 +8,14 @@ celery_app = Celery('quick_music_videos')
 celery_app.conf.update(
     broker_url=os.environ.get('REDIS_URL', 'redis://localhost:6379'),
     result_backend=os.environ.get('REDIS_URL', 'redis://localhost:6379'),
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
+    # msgpack on the wire; JSON still accepted for messages queued before the switch
+    task_serializer='msgpack',
+    accept_content=['msgpack', 'json'],
+    result_serializer='msgpack',
+    # Keep broker/backend Redis connections bounded and alive
+    redis_max_connections=50,
+    redis_socket_keepalive=True,
+    redis_retry_on_timeout=True,
     timezone='UTC',
     enable_utc=True,
     # Import tasks
@@ -19,9 +24,12 @@ celery_app.conf.update(
     task_routes={
         'phase2_worker.process_music_generation': {'queue': 'music_generation'},
         'phase3_worker.process_video_generation': {'queue': 'video_generation'},
+        'phase3_worker.render_song_video': {'queue': 'video_generation'},
+        'phase3_worker.finalize_video_generation': {'queue': 'video_generation'},
     },
     # Worker settings
-    worker_concurrency=2,
+    # Also read by phase3_worker to split CPU threads between renders
+    worker_concurrency=int(os.environ.get('CELERY_CONCURRENCY', 2)),
     worker_max_tasks_per_child=50,
     # Task settings
     task_acks_late=True,
@@ -0,0 +1,13 @@
+"""
+Gunicorn configuration for the web app
+"""
+import os
+
+# Gemini and Redis calls spend most of their time waiting on the network,
+# so each worker serves requests from a thread pool instead of one at a time
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+# Gemini responses can take several seconds
+timeout = 120
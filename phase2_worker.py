@@ -1,13 +1,23 @@
 import os
 import redis
 import json
+import orjson
+import atexit
 import time
+import random
 import logging
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timezone
 from typing import Dict, Any, Optional, List
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+import hashlib
+from celery.signals import worker_process_init
 from celery_app import celery_app
+from utils.session_manager import decode_preferences
 
 # Optional Google Cloud Storage import
 try:
@@ -23,7 +33,69 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Redis connection
-redis_client = redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+
+# One bounded pool for all command traffic in this process
+redis_pool = redis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=50,
+    socket_keepalive=True,
+    health_check_interval=30,
+    retry_on_timeout=True,
+)
+redis_client = redis.Redis(connection_pool=redis_pool)
+
+# Pub/sub holds its connection for the lifetime of the subscription, so it gets its own small pool
+pubsub_pool = redis.ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=2,
+    socket_keepalive=True,
+    health_check_interval=30,
+)
+
+
+def create_http_session() -> requests.Session:
+    """Create a keep-alive HTTP(S) session with connection pooling and retries on transient errors"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504]
+        ),
+    )
+    # Suno's audio CDN links are not always https, so plain http gets the same pool and retries
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Resumable GCS uploads read the audio stream in chunks of this size (a multiple of 256 KB)
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# How long identical Suno requests reuse a finished generation
+SUNO_CACHE_TTL = 3600
+
+# Phase 2 status hashes expire an hour after their last update
+PHASE2_STATUS_TTL = 3600
+
+# Idempotency locks that stop duplicate Phase 2 runs for a session
+PHASE2_LOCK_TTL = 3600
+
+# The song fields Phase 3 needs; the full records stay under phase2_results:{session_id}.
+# audio_url lets Phase 3 fetch songs whose GCS upload failed straight from Suno
+_PHASE3_FIELDS = ("song_id", "filename", "duration", "public_url", "audio_url")
+
+# Per-song progress markers let a retried task skip songs already stored in GCS
+PHASE2_STORED_TTL = 86400
+
+# Shared by Suno API calls and audio downloads so TLS connections are reused
+http_session = create_http_session()
+
+# One bounded pool for per-song uploads, shared by every task in this worker process
+IO_POOL_SIZE = 16
+_IO_POOL = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="phase2-io")
+atexit.register(_IO_POOL.shutdown, wait=True)
 
 from services.lyria_service import LyriaService
 
@@ -101,153 +173,196 @@ class MusicGenerationService:
                 'error': f'Lyria generation failed: {str(e)}'
             }
 
+# Suno tempo descriptions, keyed by the tempo preference
+_TEMPO_TAGS = {
+    "slow": "slow tempo, relaxed",
+    "medium": "medium tempo, steady",
+    "fast": "fast tempo, energetic",
+    "very_fast": "very fast tempo, intense",
+}
+
+
+@lru_cache(maxsize=512)
+def build_music_tags(
+    genre: Optional[str],
+    mood: Optional[str],
+    tempo: str,
+    energy: str,
+    vocal_style: str,
+) -> str:
+    """Build the comma-separated Suno tag string; memoized since retries reuse the same preferences"""
+    return ", ".join(
+        filter(
+            None,
+            [
+                genre,
+                mood,
+                _TEMPO_TAGS.get(tempo),
+                f"{energy} energy" if energy != "medium" else None,
+                "instrumental" if vocal_style == "none" else f"{vocal_style} vocals",
+            ],
+        )
+    )
+
+
 class SunoService:
     """Service for generating music using Suno API"""
 
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
         self.api_key = os.environ.get("APIBOX_KEY")
         self.base_url = os.environ.get("SUNO_BASE_URL", "https://api.sunoapi.org")
-        self.session = requests.Session()
+        self.session = session or http_session
+        # Sent per request so the shared session never leaks credentials to other hosts
+        self.headers = {}
         if self.api_key:
-            self.session.headers.update(
-                {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                }
-            )
+            self.headers = {
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+            }
 
     def create_music_tags(self, preferences: Dict[str, Any]) -> str:
         """Create music tags based on user preferences"""
         music_prefs = preferences.get("music_preferences", {})
-
-        # Build tags from preferences
-        tags = []
-
-        # Add genre
-        if music_prefs.get("genre"):
-            tags.append(music_prefs["genre"])
-
-        # Add mood
-        if music_prefs.get("mood"):
-            tags.append(music_prefs["mood"])
-
-        # Add tempo description
-        tempo = music_prefs.get("tempo", "medium")
-        tempo_tags = {
-            "slow": "slow tempo, relaxed",
-            "medium": "medium tempo, steady",
-            "fast": "fast tempo, energetic",
-            "very_fast": "very fast tempo, intense",
-        }
-        if tempo in tempo_tags:
-            tags.append(tempo_tags[tempo])
-
-        # Add energy level
-        energy = music_prefs.get("energy_level", "medium")
-        if energy != "medium":
-            tags.append(f"{energy} energy")
-
-        # Add vocal style
-        vocal_style = music_prefs.get("vocal_style", "none")
-        if vocal_style == "none":
-            tags.append("instrumental")
-        else:
-            tags.append(f"{vocal_style} vocals")
-
-        # Join tags with commas
-        return ", ".join(tags)
+        return build_music_tags(
+            music_prefs.get("genre"),
+            music_prefs.get("mood"),
+            music_prefs.get("tempo", "medium"),
+            music_prefs.get("energy_level", "medium"),
+            music_prefs.get("vocal_style", "none"),
+        )
 
     def poll_for_results(
-        self, task_id: str, max_attempts: int = 30, delay: int = 10
+        self,
+        task_id: str,
+        max_wait: float = 300,
+        initial_delay: float = 2.0,
+        max_delay: float = 30.0,
+        backoff: float = 1.5,
     ) -> List[Dict[str, Any]]:
-        """Poll Suno API for task results"""
-        import time
-
-        for attempt in range(max_attempts):
+        """Poll Suno API for task results, backing off exponentially between misses"""
+        deadline = time.monotonic() + max_wait
+        attempt = 0
+        delay = initial_delay
+        # The "still generating" body rarely changes between polls, so skip re-parsing it
+        etag = None
+        last_digest = None
+
+        while time.monotonic() < deadline:
+            attempt += 1
             try:
-                logger.info(
-                    f"Polling attempt {attempt + 1}/{max_attempts} for task {task_id}"
-                )
+                logger.info(f"Polling attempt {attempt} for task {task_id}")
+
+                headers = self.headers
+                if etag:
+                    headers = {**self.headers, "If-None-Match": etag}
 
                 # Check task status
                 response = self.session.get(
-                    f"{self.base_url}/api/v1/generate/record-info?taskId={task_id}"
+                    f"{self.base_url}/api/v1/generate/record-info?taskId={task_id}",
+                    headers=headers,
                 )
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info(f"Poll response: {result}")
-
-                    if result.get("code") == 200 and "data" in result:
-                        clips = result["data"]
-                        if clips and len(clips) > 0:
-                            # Check if songs are ready
-                            ready_songs = [
-                                song for song in clips if song.get("audio_url")
-                            ]
-                            if ready_songs:
-                                logger.info(f"Found {len(ready_songs)} ready songs")
-                                return ready_songs
-
-                    logger.info(f"Songs not ready yet, waiting {delay} seconds...")
-                    time.sleep(delay)
+                if response.status_code == 304:
+                    logger.info("Songs not ready yet (not modified)")
+                elif response.status_code == 200:
+                    etag = response.headers.get("ETag")
+                    # Without an ETag, fall back to comparing a digest of the body
+                    digest = (
+                        None
+                        if etag
+                        else hashlib.blake2b(response.content, digest_size=16).digest()
+                    )
+                    if digest is not None and digest == last_digest:
+                        logger.info("Songs not ready yet (unchanged response)")
+                    else:
+                        last_digest = digest
+                        result = orjson.loads(response.content)
+                        logger.debug("Poll response: %s", result)
+
+                        if result.get("code") == 200 and "data" in result:
+                            clips = result["data"]
+                            if clips and len(clips) > 0:
+                                # Check if songs are ready
+                                ready_songs = [
+                                    song for song in clips if song.get("audio_url")
+                                ]
+                                if ready_songs:
+                                    logger.info(f"Found {len(ready_songs)} ready songs")
+                                    return ready_songs
+
+                        logger.info("Songs not ready yet")
                 else:
                     logger.warning(
                         f"Poll request failed: {response.status_code} - {response.text}"
                     )
-                    time.sleep(delay)
 
             except Exception as e:
                 logger.error(f"Error polling for results: {e}")
-                time.sleep(delay)
 
-        logger.warning(f"Polling timeout after {max_attempts} attempts")
+            # Poll quickly at first so short jobs are noticed early, then back off; jitter
+            # keeps concurrent sessions from polling in lockstep. The deadline caps the last sleep.
+            # (429/503 Retry-After headers are already honored by the session's retry adapter.)
+            sleep_for = delay + random.uniform(0, 0.3 * delay)
+            time.sleep(max(0, min(sleep_for, deadline - time.monotonic())))
+            delay = min(max_delay, delay * backoff)
+
+        logger.warning(f"Polling timeout after {max_wait} seconds ({attempt} attempts)")
         return []
 
     def check_callback_results(
         self, task_id: str, timeout: int = 300
     ) -> List[Dict[str, Any]]:
-        """Check for callback results before polling"""
-        import time
+        """Block until Suno's callback for the task lands in Redis, then fetch its songs"""
+        callback_key = f"suno:done:{task_id}"
+        try:
+            # The callback endpoint pushes onto this list, so BLPOP replaces the 5s GET loop.
+            # Block in short slices so a stopping worker is never stuck in one long call.
+            deadline = time.monotonic() + timeout
+            popped = None
+            while not popped:
+                remaining = deadline - time.monotonic()
+                if remaining < 1:
+                    break
+                popped = redis_client.blpop([callback_key], timeout=int(min(remaining, 30)))
+            if not popped:
+                logger.warning(
+                    f"No callback received for task {task_id} within {timeout} seconds"
+                )
+                return []
 
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            try:
-                # Check if callback data is available
-                callback_key = f"suno_callback:{task_id}"
-                callback_data = redis_client.get(callback_key)
-
-                if callback_data:
-                    data = json.loads(callback_data)
-                    logger.info(f"Found callback data for task {task_id}: {data}")
-
-                    if data.get("status") == "complete":
-                        # Get the actual song data using the task ID
-                        response = self.session.get(
-                            f"{self.base_url}/api/v1/generate/record-info?taskId={task_id}"
-                        )
-                        if response.status_code == 200:
-                            result = response.json()
-                            if result.get("code") == 200 and "data" in result:
-                                clips = result["data"]
-                                if clips and len(clips) > 0:
-                                    ready_songs = [
-                                        song for song in clips if song.get("audio_url")
-                                    ]
-                                    if ready_songs:
-                                        logger.info(
-                                            f"Retrieved {len(ready_songs)} songs from callback"
-                                        )
-                                        return ready_songs
-
-                time.sleep(5)  # Check every 5 seconds
+            data = orjson.loads(popped[1])
+            logger.debug("Found callback data for task %s: %s", task_id, data)
 
-            except Exception as e:
-                logger.error(f"Error checking callback: {e}")
-                time.sleep(5)
+            if data.get("status") == "complete":
+                # The callback usually carries the finished clips; use them without another request
+                ready_songs = [
+                    song for song in data.get("clips") or [] if song.get("audio_url")
+                ]
+                if ready_songs:
+                    logger.info(f"Retrieved {len(ready_songs)} songs from callback payload")
+                    return ready_songs
+
+                # Otherwise get the actual song data using the task ID
+                response = self.session.get(
+                    f"{self.base_url}/api/v1/generate/record-info?taskId={task_id}",
+                    headers=self.headers,
+                )
+                if response.status_code == 200:
+                    result = orjson.loads(response.content)
+                    if result.get("code") == 200 and "data" in result:
+                        clips = result["data"]
+                        if clips and len(clips) > 0:
+                            ready_songs = [
+                                song for song in clips if song.get("audio_url")
+                            ]
+                            if ready_songs:
+                                logger.info(
+                                    f"Retrieved {len(ready_songs)} songs from callback"
+                                )
+                                return ready_songs
+
+        except Exception as e:
+            logger.error(f"Error checking callback: {e}")
 
-        logger.warning(
-            f"No callback received for task {task_id} within {timeout} seconds"
-        )
         return []
 
     def generate_music(
@@ -282,21 +397,43 @@ class SunoService:
             }
 
             logger.info(f"Generating music for session {session_id} with tags: {tags}")
-            logger.info(f"Suno API request: {suno_request}")
+            logger.debug("Suno API request: %s", suno_request)
+
+            # Identical requests within the cache window reuse the earlier generation
+            cache_key = "suno:cache:" + hashlib.blake2b(
+                orjson.dumps(suno_request, option=orjson.OPT_SORT_KEYS), digest_size=16
+            ).hexdigest()
+            cached = redis_client.get(cache_key)
+            if cached:
+                cached_result = orjson.loads(cached)
+                logger.info(f"Reusing cached Suno generation for session {session_id}")
+                return {
+                    "success": True,
+                    "songs": cached_result["songs"],
+                    "generation_id": cached_result.get("generation_id"),
+                    "session_id": session_id,
+                    "tags_used": tags,
+                    "cached": True,
+                }
 
             # Make request to Suno API
             response = self.session.post(
-                f"{self.base_url}/api/v1/generate", json=suno_request, timeout=120
+                f"{self.base_url}/api/v1/generate",
+                json=suno_request,
+                headers=self.headers,
+                timeout=120,
             )
 
             logger.info(f"Suno API response status: {response.status_code}")
-            logger.info(f"Suno API response text: {response.text[:500]}...")
+            # Full payloads are only formatted when DEBUG logging is on
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Suno API response text: %s...", response.text[:500])
 
             if response.status_code == 200:
                 try:
-                    suno_response = response.json()
-                    logger.info(f"Suno API response JSON: {suno_response}")
-                except json.JSONDecodeError as e:
+                    suno_response = orjson.loads(response.content)
+                    logger.debug("Suno API response JSON: %s", suno_response)
+                except orjson.JSONDecodeError as e:
                     logger.error(f"Failed to parse JSON response: {e}")
                     logger.error(f"Response content: {response.text}")
                     return {
@@ -307,7 +444,7 @@ class SunoService:
                 # Check if we got a taskId (async response)
                 if "data" in suno_response and "taskId" in suno_response["data"]:
                     task_id = suno_response["data"]["taskId"]
-                    logger.info(f"Got taskId: {taskId}, waiting for callback...")
+                    logger.info(f"Got taskId: {task_id}, waiting for callback...")
 
                     # First check for callback results (preferred method)
                     songs = self.check_callback_results(task_id, timeout=300)
@@ -323,9 +460,15 @@ class SunoService:
                     songs = suno_response.get("clips", [])
                     logger.info(f"Found {len(songs)} songs in direct response")
 
-                results = []
-                for i, song in enumerate(songs[:2]):  # Ensure we only take 2
-                    song_data = {
+                # Fields shared by every clip are built once, outside the loop
+                received_at = datetime.now(timezone.utc).isoformat()
+                prefs_metadata = {
+                    "genre": music_prefs.get("genre"),
+                    "mood": music_prefs.get("mood"),
+                    "tempo": music_prefs.get("tempo"),
+                }
+                results = [
+                    {
                         "song_id": song.get("id"),
                         "title": song.get("title", f"Song {i+1}"),
                         "audio_url": song.get("audio_url"),
@@ -333,18 +476,27 @@ class SunoService:
                         "tags": song.get("tags", tags),
                         "prompt": song.get("prompt", music_prompt),
                         "status": song.get("status", "complete"),
-                        "created_at": song.get(
-                            "created_at", datetime.utcnow().isoformat()
-                        ),
+                        "created_at": song.get("created_at", received_at),
                         "metadata": {
                             "bpm": song.get("bpm"),
                             "key": song.get("key"),
-                            "genre": music_prefs.get("genre"),
-                            "mood": music_prefs.get("mood"),
-                            "tempo": music_prefs.get("tempo"),
+                            **prefs_metadata,
                         },
                     }
-                    results.append(song_data)
+                    for i, song in enumerate(songs[:2])  # Ensure we only take 2
+                ]
+
+                if results:
+                    redis_client.setex(
+                        cache_key,
+                        SUNO_CACHE_TTL,
+                        orjson.dumps(
+                            {
+                                "songs": results,
+                                "generation_id": suno_response.get("id"),
+                            }
+                        ),
+                    )
 
                 return {
                     "success": True,
@@ -362,22 +514,32 @@ class SunoService:
                     "error": f"Suno API error: {response.status_code} - {response.text}",
                 }
 
+        except requests.RequestException:
+            # Network failures propagate so the task's autoretry can back off and try again
+            raise
         except Exception as e:
             logger.error(f"Error generating music: {e}")
             return {"success": False, "error": str(e)}
 
 
+def session_shard(session_id: str) -> str:
+    """Two-hex-digit prefix that spreads sessions across GCS key ranges"""
+    return hashlib.blake2b(session_id.encode(), digest_size=1).hexdigest()
+
+
 class GCSService:
     """Service for storing files in Google Cloud Storage"""
 
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
+        self.http = session or http_session
         self.bucket_name = os.environ.get("GCS_BUCKET_NAME")
+        # With uniform bucket-level access, public reads come from the bucket IAM policy
+        self.uniform_access = os.environ.get("GCS_UNIFORM_ACCESS", "false").lower() == "true"
         if self.bucket_name and GCS_AVAILABLE:
             try:
                 # Check if we have JSON credentials in environment
                 creds_json = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS_JSON")
                 if creds_json:
-                    import json
                     from google.oauth2 import service_account
 
                     # Parse JSON credentials from environment variable
@@ -392,6 +554,12 @@ class GCSService:
                     self.client = storage.Client()
                     logger.info("GCS initialized with default credentials")
 
+                # The client's default pool keeps 10 connections; size it for the upload threads
+                # so concurrent uploads reuse keep-alive connections instead of discarding them
+                self.client._http.mount(
+                    "https://", HTTPAdapter(pool_maxsize=IO_POOL_SIZE)
+                )
+
                 self.bucket = self.client.bucket(self.bucket_name)
                 logger.info(f"GCS bucket '{self.bucket_name}' connected successfully")
             except Exception as e:
@@ -407,166 +575,258 @@ class GCSService:
             self.bucket = None
 
     def upload_audio_file(
-        self, audio_url: str, session_id: str, song_index: int, song_id: str
+        self,
+        audio_url: str,
+        session_id: str,
+        song_index: int,
+        song_id: str,
+        metadata: Optional[Dict[str, str]] = None,
     ) -> Dict[str, Any]:
-        """Download audio from Suno URL and upload to GCS"""
+        """Download audio from Suno URL and upload to GCS with `metadata` as custom object metadata"""
         try:
             if not self.bucket:
                 return {"success": False, "error": "GCS not configured"}
 
-            # Download audio from Suno URL
-            response = requests.get(audio_url, stream=True, timeout=120)
-            response.raise_for_status()
-
-            # Generate unique filename
-            filename = f"music/{session_id}/song_{song_index}_{song_id}.mp3"
-
-            # Upload to GCS
-            blob = self.bucket.blob(filename)
-            blob.upload_from_string(response.content, content_type="audio/mpeg")
-
-            # Make blob publicly accessible
-            blob.make_public()
+            # Download audio from Suno URL; leaving the block returns the connection to the pool
+            with self.http.get(audio_url, stream=True, timeout=120) as response:
+                response.raise_for_status()
+
+                # Generate unique filename
+                filename = f"music/{session_shard(session_id)}/{session_id}/song_{song_index}_{song_id}.mp3"
+
+                # Stream the download straight into GCS instead of buffering the MP3 in memory
+                content_length = response.headers.get("Content-Length")
+                if response.headers.get("Content-Encoding"):
+                    content_length = None  # encoded length differs from the decoded bytes we upload
+                response.raw.decode_content = True
+
+                # Known-length songs under 8 MB go up as one multipart request; anything else is a
+                # resumable upload read in 4 MB chunks rather than the client's 100 MB default
+                blob = self.bucket.blob(filename, chunk_size=UPLOAD_CHUNK_SIZE)
+                blob.metadata = metadata
+                blob.upload_from_file(
+                    response.raw,
+                    size=int(content_length) if content_length else None,
+                    content_type="audio/mpeg",
+                    rewind=False,
+                    # Set the public ACL in the upload itself rather than a separate make_public() call
+                    predefined_acl=None if self.uniform_access else "publicRead",
+                )
 
             return {
                 "success": True,
                 "gcs_path": f"gs://{self.bucket_name}/{filename}",
-                "public_url": blob.public_url,
+                "public_url": f"https://storage.googleapis.com/{self.bucket_name}/{filename}",
                 "filename": filename,
-                "file_size": len(response.content),
+                "file_size": blob.size,
             }
 
+        except requests.RequestException:
+            # Network failures propagate so the task's autoretry can back off and try again
+            raise
         except Exception as e:
             logger.error(f"Error uploading to GCS: {e}")
             return {"success": False, "error": str(e)}
 
-    def store_song_metadata(
-        self, session_id: str, song_data: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        """Store song metadata as JSON in GCS"""
-        try:
-            if not self.bucket:
-                return {"success": False, "error": "GCS not configured"}
-
-            filename = (
-                f"metadata/{session_id}/song_{song_data['song_id']}_metadata.json"
-            )
-
-            blob = self.bucket.blob(filename)
-            blob.upload_from_string(
-                json.dumps(song_data, indent=2), content_type="application/json"
-            )
-
-            return {
-                "success": True,
-                "metadata_path": f"gs://{self.bucket_name}/{filename}",
-                "filename": filename,
-            }
-
-        except Exception as e:
-            logger.error(f"Error storing metadata: {e}")
-            return {"success": False, "error": str(e)}
-
 
 # Initialize services
 suno_service = SunoService()
 gcs_service = GCSService()
 
 
-@celery_app.task(bind=True, max_retries=3, default_retry_delay=60)
+@worker_process_init.connect
+def reset_http_clients(**kwargs):
+    """Give each forked worker process its own HTTP and GCS connections"""
+    global http_session, suno_service, gcs_service
+    http_session = create_http_session()
+    suno_service = SunoService()
+    gcs_service = GCSService()
+
+
+def stored_song_field(song: Dict[str, Any], song_index: int) -> str:
+    """Field for a song in the phase2:stored hash; songs without a provider id are keyed by position"""
+    song_id = song.get("song_id")
+    return str(song_id) if song_id is not None else f"index:{song_index}"
+
+
+def store_song(session_id: str, song_index: int, song: Dict[str, Any]) -> Dict[str, Any]:
+    """Upload one song and its metadata to GCS, falling back to the Suno URL on failure"""
+    # Song details ride along as custom object metadata rather than a separate JSON upload
+    metadata = {
+        "song_id": song["song_id"],
+        "title": song.get("title"),
+        "duration": song.get("duration"),
+        "tags": song.get("tags"),
+        "prompt": (song.get("prompt") or "")[:1024],
+        **song.get("metadata", {}),
+    }
+    metadata = {key: str(value) for key, value in metadata.items() if value}
+
+    # Upload audio file
+    gcs_result = gcs_service.upload_audio_file(
+        song["audio_url"], session_id, song_index, song["song_id"], metadata
+    )
+
+    if gcs_result["success"]:
+        # Update song data with GCS info
+        song["gcs_path"] = gcs_result["gcs_path"]
+        song["public_url"] = gcs_result["public_url"]
+        song["filename"] = gcs_result["filename"]
+        song["file_size"] = gcs_result["file_size"]
+
+        # Record the stored song so a retry can reuse it without touching GCS
+        stored_key = f"phase2:stored:{session_id}"
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(stored_key, stored_song_field(song, song_index), orjson.dumps(song))
+            pipe.expire(stored_key, PHASE2_STORED_TTL)
+            pipe.execute()
+
+        logger.info(
+            f"Stored song {song_index} ({song['duration']}s) for session {session_id}"
+        )
+    else:
+        logger.warning(
+            f"Failed to store song {song_index} in GCS: {gcs_result['error']}"
+        )
+        # Still return the song with Suno URL as fallback
+
+    return song
+
+
+def update_phase2_status(
+    session_id: str,
+    status: str,
+    pipe: Optional[redis.client.Pipeline] = None,
+    reset: bool = False,
+    **fields: Any,
+) -> None:
+    """Write a Phase 2 status transition to the status hash (batched into `pipe` when given)"""
+    status_key = f"phase2_status:{session_id}"
+    # Only the changed fields travel on a transition; constant fields go with the first write
+    mapping = {
+        "status": status,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        **fields,
+    }
+    if reset:
+        mapping["phase"] = 2
+
+    target = pipe if pipe is not None else redis_client.pipeline(transaction=False)
+    if reset:
+        target.delete(status_key)
+    target.hset(status_key, mapping=mapping)
+    target.expire(status_key, PHASE2_STATUS_TTL)
+    if pipe is None:
+        target.execute()
+
+
+# Failures worth retrying; anything else fails the task immediately
+TRANSIENT_ERRORS = (requests.RequestException, redis.exceptions.ConnectionError)
+
+
+@celery_app.task(
+    bind=True,
+    max_retries=3,
+    autoretry_for=TRANSIENT_ERRORS,
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_jitter=True,
+)
 def process_music_generation(self, session_id: str):
     """Celery task to process music generation (Phase 2)"""
+    # Only one task per session may generate music; retries keep the same task id
+    lock_key = f"phase2:lock:{session_id}"
+    if not redis_client.set(lock_key, self.request.id, nx=True, ex=PHASE2_LOCK_TTL):
+        owner = redis_client.get(lock_key)
+        if owner is not None and owner.decode("utf-8") != self.request.id:
+            logger.warning(f"Phase 2 already running for session {session_id}, skipping duplicate task")
+            return {"success": False, "error": "Duplicate Phase 2 task"}
+
     try:
         logger.info(f"Starting music generation for session {session_id}")
 
-        # Get preferences from Redis
+        # Read preferences and open the attempt's status (clearing fields left by a previous
+        # attempt) in one round-trip
         preferences_key = f"preferences:{session_id}"
-        preferences_data = redis_client.get(preferences_key)
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.get(preferences_key)
+            update_phase2_status(
+                session_id,
+                "processing",
+                pipe=pipe,
+                reset=True,
+                message="Generating music with Suno AI...",
+            )
+            preferences_data = pipe.execute()[0]
 
         if not preferences_data:
             logger.error(f"No preferences found for session {session_id}")
-            return {"success": False, "error": "Preferences not found"}
-
-        preferences = json.loads(preferences_data)
-
-        # Update status to processing
-        status_key = f"phase2_status:{session_id}"
-        redis_client.setex(
-            status_key,
-            3600,
-            json.dumps(
-                {
-                    "status": "processing",
-                    "phase": 2,
-                    "message": "Generating music with Suno AI...",
-                    "timestamp": datetime.utcnow().isoformat(),
-                }
-            ),
-        )
+            error = "Preferences not found"
+        else:
+            preferences = decode_preferences(preferences_data)
+
+            # Don't spend a paid Suno generation on preferences it can't use
+            music_prefs = preferences.get("music_preferences") or {}
+            error = None
+            if not (music_prefs.get("genre") or music_prefs.get("music_prompt")):
+                logger.error(f"Invalid preferences for session {session_id}: no genre or music prompt")
+                error = "invalid preferences"
+
+        if error:
+            with redis_client.pipeline(transaction=False) as pipe:
+                update_phase2_status(session_id, "failed", pipe=pipe, error=error)
+                pipe.delete(lock_key)
+                pipe.execute()
+            return {"success": False, "error": error}
 
         # Generate music with Suno
         music_result = suno_service.generate_music(preferences, session_id)
 
         if not music_result["success"]:
-            # Update status to failed
-            redis_client.setex(
-                status_key,
-                3600,
-                json.dumps(
-                    {
-                        "status": "failed",
-                        "phase": 2,
-                        "error": music_result["error"],
-                        "timestamp": datetime.utcnow().isoformat(),
-                    }
-                ),
-            )
+            # Mark the failure and release the lock in one round-trip
+            with redis_client.pipeline(transaction=False) as pipe:
+                update_phase2_status(
+                    session_id, "failed", pipe=pipe, error=music_result["error"]
+                )
+                pipe.delete(lock_key)
+                pipe.execute()
             return music_result
 
         # Update status to storing
-        redis_client.setex(
-            status_key,
-            3600,
-            json.dumps(
-                {
-                    "status": "storing",
-                    "phase": 2,
-                    "message": "Storing songs in Google Cloud Storage...",
-                    "timestamp": datetime.utcnow().isoformat(),
-                }
-            ),
+        update_phase2_status(
+            session_id, "storing", message="Storing songs in Google Cloud Storage..."
         )
 
-        # Store songs in GCS
-        stored_songs = []
-        for i, song in enumerate(music_result["songs"]):
-            # Upload audio file
-            gcs_result = gcs_service.upload_audio_file(
-                song["audio_url"], session_id, i + 1, song["song_id"]
-            )
+        # Store songs in GCS; each song is independent network I/O, so run them concurrently
+        songs = music_result["songs"]
+        stored_songs = [None] * len(songs)
 
-            if gcs_result["success"]:
-                # Update song data with GCS info
-                song["gcs_path"] = gcs_result["gcs_path"]
-                song["public_url"] = gcs_result["public_url"]
-                song["filename"] = gcs_result["filename"]
-                song["file_size"] = gcs_result["file_size"]
-
-                # Store metadata
-                metadata_result = gcs_service.store_song_metadata(session_id, song)
-                if metadata_result["success"]:
-                    song["metadata_path"] = metadata_result["metadata_path"]
-
-                stored_songs.append(song)
-                logger.info(
-                    f"Stored song {i+1} ({song['duration']}s) for session {session_id}"
-                )
+        # On retry, reuse songs a previous attempt already stored. The markers belong to one
+        # generation: a fresh one (not served from the Suno cache) starts from an empty hash,
+        # otherwise id-less songs keyed by position would match an earlier generation's uploads
+        stored_key = f"phase2:stored:{session_id}"
+        if music_result.get("cached"):
+            already_stored = redis_client.hgetall(stored_key)
+        else:
+            redis_client.delete(stored_key)
+            already_stored = {}
+        pending = []
+        for i, song in enumerate(songs):
+            cached = already_stored.get(stored_song_field(song, i + 1).encode())
+            if cached:
+                stored_songs[i] = orjson.loads(cached)
             else:
-                logger.warning(
-                    f"Failed to store song {i+1} in GCS: {gcs_result['error']}"
-                )
-                # Still add the song with Suno URL as fallback
-                stored_songs.append(song)
+                pending.append(i)
+        if len(pending) < len(songs):
+            logger.info(
+                f"Skipping {len(songs) - len(pending)} already stored songs for session {session_id}"
+            )
+
+        futures = {
+            _IO_POOL.submit(store_song, session_id, i + 1, songs[i]): i for i in pending
+        }
+        for future in as_completed(futures):
+            stored_songs[futures[future]] = future.result()
 
         # Store final results in Redis
         results_key = f"phase2_results:{session_id}"
@@ -577,39 +837,42 @@ def process_music_generation(self, session_id: str):
             "total_songs": len(stored_songs),
             "generation_id": music_result.get("generation_id"),
             "tags_used": music_result.get("tags_used"),
-            "completed_at": datetime.utcnow().isoformat(),
+            "completed_at": datetime.now(timezone.utc).isoformat(),
             "phase": 2,
         }
 
-        redis_client.setex(
-            results_key, 86400, json.dumps(final_results)
-        )  # Store for 24 hours
-
-        # Update status to completed
-        redis_client.setex(
-            status_key,
-            3600,
-            json.dumps(
-                {
-                    "status": "completed",
-                    "phase": 2,
-                    "message": f"Successfully generated and stored {len(stored_songs)} songs",
-                    "songs_count": len(stored_songs),
-                    "timestamp": datetime.utcnow().isoformat(),
-                }
-            ),
-        )
+        # Persist results, final status and the Phase 3 handoff in one round-trip
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.setex(
+                results_key, 86400, orjson.dumps(final_results)
+            )  # Store for 24 hours
+
+            # Update status to completed
+            update_phase2_status(
+                session_id,
+                "completed",
+                pipe=pipe,
+                message=f"Successfully generated and stored {len(stored_songs)} songs",
+                songs_count=len(stored_songs),
+            )
 
-        # Store Phase 2 results for Phase 3
-        redis_client.hset(
-            f"session:{session_id}",
-            "phase2_results",
-            json.dumps(final_results)
-        )
+            # Store a slim summary of the Phase 2 results for Phase 3
+            phase3_summary = {
+                "session_id": session_id,
+                "songs": [
+                    {field: song.get(field) for field in _PHASE3_FIELDS}
+                    for song in stored_songs
+                ],
+            }
+            pipe.hset(
+                f"session:{session_id}",
+                "phase2_results",
+                orjson.dumps(phase3_summary)
+            )
+            pipe.execute()
 
-        # Trigger Phase 3 (video generation)
-        from phase3_worker import process_video_generation
-        process_video_generation.delay(session_id)
+        # Trigger Phase 3 (video generation) by name so this module never imports phase3_worker
+        celery_app.send_task("phase3_worker.process_video_generation", args=[session_id])
 
         logger.info(f"Phase 2 completed for session {session_id}")
         return final_results
@@ -617,24 +880,55 @@ def process_music_generation(self, session_id: str):
     except Exception as e:
         logger.error(f"Error in music generation task: {e}")
         
-        # Update status to failed
-        status_key = f"phase2_status:{session_id}"
-        redis_client.setex(
-            status_key,
-            3600,
-            json.dumps(
-                {
-                    "status": "failed",
-                    "phase": 2,
-                    "error": str(e),
-                    "timestamp": datetime.utcnow().isoformat(),
-                }
-            ),
+        will_retry = (
+            isinstance(e, TRANSIENT_ERRORS) and self.request.retries < self.max_retries
         )
-        
-        # Retry the task
-        if self.request.retries < self.max_retries:
-            logger.info(f"Retrying task in {self.default_retry_delay} seconds...")
-            raise self.retry(countdown=self.default_retry_delay)
-        
-        return {"success": False, "error": str(e)}
\ No newline at end of file
+
+        # Update status to failed; on a permanent failure or once out of retries,
+        # release the lock in the same round-trip so the session can be regenerated
+        with redis_client.pipeline(transaction=False) as pipe:
+            update_phase2_status(session_id, "failed", pipe=pipe, error=str(e))
+            if not will_retry:
+                pipe.delete(lock_key)
+            pipe.execute()
+
+        # Transient errors are retried by Celery with jittered exponential backoff
+        if will_retry:
+            logger.info(f"Retrying task after transient error (attempt {self.request.retries + 1})")
+            raise
+
+        return {"success": False, "error": str(e)}
+
+
+class RedisListener:
+    """Listen for Phase 1 completion events and queue Phase 2 music generation"""
+
+    def __init__(self, pool: Optional[redis.ConnectionPool] = None):
+        self.redis_client = redis.Redis(connection_pool=pool or pubsub_pool)
+        self.channel = "phase1_completed"
+
+    def start_listening(self):
+        """Block on the pub/sub channel and dispatch a task per completed session"""
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        logger.info(f"Listening for events on '{self.channel}'")
+
+        for message in pubsub.listen():
+            session_id = message["data"]
+            if isinstance(session_id, bytes):
+                session_id = session_id.decode("utf-8")
+
+            # Redelivered or duplicate events must not start a second paid generation
+            if not self.redis_client.set(
+                f"phase2:trigger:{session_id}", "1", nx=True, ex=PHASE2_LOCK_TTL
+            ):
+                logger.info(f"Phase 2 already triggered for session {session_id}, skipping")
+                continue
+
+            logger.info(f"Phase 1 completed for session {session_id}, queueing Phase 2")
+            process_music_generation.delay(session_id)
+
+
+def run_redis_listener():
+    """Entry point for the Redis listener process"""
+    RedisListener().start_listening()
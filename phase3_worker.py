@@ -1,35 +1,107 @@
 import asyncio
+import io
+import aiohttp
 import os
-import json
+import orjson
 import logging
-from typing import List, Dict, Any
-from celery import Celery
-import redis
+from typing import List, Dict, Any, Optional, Tuple
+from celery import chord, group
+from celery.signals import worker_process_shutdown
 from runware import Runware, IImageInference
 from services.gemini_service import GeminiService
-from utils.session_manager import SessionManager
+from utils.session_manager import SessionManager, get_redis
 from google.cloud import storage
 import requests
+import subprocess
 import tempfile
-from moviepy.editor import ImageSequenceClip, AudioFileClip, CompositeVideoClip
+from datetime import datetime, timezone
+import threading
+import imageio_ffmpeg
 import librosa
+import soundfile as sf
 import numpy as np
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Celery app
-celery_app = Celery('phase3_worker')
-celery_app.config_from_object('celery_app')
+# Share the configured Celery app so chords use the project's broker and result backend
+from celery_app import celery_app
 
 # Initialize services
-redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
-session_manager = SessionManager()
+redis_client = get_redis()
+session_manager = SessionManager(redis_client)
 gemini_service = GeminiService()
 gcs_client = storage.Client()
 bucket_name = os.getenv('GCS_BUCKET_NAME', 'qmv-storage')
 bucket = gcs_client.bucket(bucket_name)
+# With uniform bucket-level access, public reads come from the bucket IAM policy
+uniform_access = os.getenv('GCS_UNIFORM_ACCESS', 'false').lower() == 'true'
+
+# Count a finished video and update the progress percentage in one round-trip
+RECORD_VIDEO_DONE_SCRIPT = """
+local done = redis.call('HINCRBY', KEYS[1], 'phase3_videos_done', 1)
+redis.call('HSET', KEYS[1], 'phase3_progress', math.floor(done * 100 / tonumber(ARGV[1])))
+return done
+"""
+record_video_done = redis_client.register_script(RECORD_VIDEO_DONE_SCRIPT)
+
+# Finished videos upload in resumable chunks of this size (a multiple of 256 KB)
+VIDEO_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Output frame sizes for the resolution preference
+VIDEO_RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+def runware_image_size(width: int, height: int) -> Tuple[int, int]:
+    """Closest size Runware accepts for a frame: multiples of 64, longest side at most 2048"""
+    scale = min(1.0, 2048 / max(width, height))
+    return round(width * scale / 64) * 64, round(height * scale / 64) * 64
+
+# ffmpeg executable: IMAGEIO_FFMPEG_EXE if set, else the system or bundled binary
+FFMPEG_BINARY = imageio_ffmpeg.get_ffmpeg_exe()
+
+# Extra ffmpeg arguments per encoder; NVENC has its own preset names and rate control
+ENCODER_PARAMS = {
+    'h264_nvenc': ['-preset', 'p4', '-tune', 'hq', '-rc', 'vbr', '-cq', '23'],
+    # libx264's default medium preset dominates CPU render time; veryfast encodes several times faster
+    'libx264': ['-preset', os.getenv('X264_PRESET', 'veryfast'), '-crf', os.getenv('X264_CRF', '26'),
+                '-tune', 'fastdecode'],
+}
+
+def select_video_encoder() -> str:
+    """Use VIDEO_CODEC if set, otherwise NVENC when a test encode on the GPU succeeds"""
+    codec = os.getenv('VIDEO_CODEC', 'auto')
+    if codec != 'auto':
+        return codec
+    
+    try:
+        # Listing the encoder isn't enough: ffmpeg builds ship NVENC even on hosts without a GPU
+        probe = subprocess.run(
+            [FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error',
+             '-f', 'lavfi', '-i', 'color=size=256x256:duration=0.1',
+             '-c:v', 'h264_nvenc', '-f', 'null', '-'],
+            capture_output=True,
+            timeout=30
+        )
+        if probe.returncode == 0:
+            return 'h264_nvenc'
+    except Exception as e:
+        logger.warning(f"NVENC probe failed: {str(e)}")
+    return 'libx264'
+
+VIDEO_ENCODER = select_video_encoder()
+logger.info(f"Encoding videos with {VIDEO_ENCODER}")
+
+# CPU threads one render may use, so concurrent renders on a worker don't oversubscribe it
+FFMPEG_THREADS = int(os.getenv('CELERY_CPU_SLOT') or
+                     max(1, (os.cpu_count() or 1) // (celery_app.conf.worker_concurrency or 1)))
+
+# Image requests one song keeps in flight; every song in a session renders at once via the chord
+RUNWARE_MAX_CONCURRENCY = int(os.getenv('RUNWARE_MAX_CONCURRENCY', 16))
 
 class RunwareService:
     def __init__(self):
@@ -70,12 +142,16 @@ class RunwareService:
             logger.error(f"Error generating image with prompt '{prompt}': {str(e)}")
             raise
     
-    async def generate_images_batch(self, prompts: List[str], width: int = 1024, height: int = 1024) -> List[str]:
-        """Generate multiple images concurrently"""
-        tasks = []
-        for prompt in prompts:
-            task = self.generate_image(prompt, width, height)
-            tasks.append(task)
+    async def generate_images_batch(self, prompts: List[str], width: int = 1024, height: int = 1024,
+                                    max_concurrency: int = RUNWARE_MAX_CONCURRENCY) -> List[str]:
+        """Generate multiple images concurrently, at most max_concurrency in flight"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def bounded(prompt: str) -> str:
+            async with semaphore:
+                return await self.generate_image(prompt, width, height)
+        
+        tasks = [bounded(prompt) for prompt in prompts]
         
         try:
             results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -94,29 +170,90 @@ class RunwareService:
             logger.error(f"Batch image generation failed: {str(e)}")
             raise
 
+# One event loop and Runware connection per worker process, reused across songs
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_runware_service: Optional[RunwareService] = None
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return this process's event loop, creating it on first use"""
+    global _event_loop
+    if _event_loop is None or _event_loop.is_closed():
+        _event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_event_loop)
+    return _event_loop
+
+async def get_runware_service() -> RunwareService:
+    """Return the connected Runware service, connecting on first use"""
+    global _runware_service
+    if _runware_service is None:
+        service = RunwareService()
+        await service.connect()
+        _runware_service = service
+    return _runware_service
+
+async def reset_runware_service():
+    """Drop the shared Runware connection so the next song reconnects"""
+    global _runware_service
+    service, _runware_service = _runware_service, None
+    if service:
+        try:
+            await service.disconnect()
+        except Exception as e:
+            logger.warning(f"Error disconnecting from Runware: {str(e)}")
+
+@worker_process_shutdown.connect
+def close_runware_connection(**kwargs):
+    """Disconnect from Runware when the worker process exits"""
+    if _runware_service and _event_loop and not _event_loop.is_closed():
+        _event_loop.run_until_complete(reset_runware_service())
+        _event_loop.close()
+
 class AudioAnalyzer:
+    SAMPLE_RATE = 22050
+    
     @staticmethod
-    def analyze_audio(audio_file_path: str) -> Dict[str, Any]:
-        """Analyze audio file to extract beats and timing information"""
+    def load_audio(audio_data: bytes):
+        """Decode audio to mono float32 at SAMPLE_RATE, reading with libsndfile when it can"""
+        try:
+            y, sr = sf.read(io.BytesIO(audio_data), dtype='float32')
+        except RuntimeError:
+            # libsndfile builds older than 1.1 can't decode MP3; librosa's fallback decoder
+            # needs a real file
+            with tempfile.NamedTemporaryFile(suffix='.mp3') as temp_audio_file:
+                temp_audio_file.write(audio_data)
+                temp_audio_file.flush()
+                return librosa.load(temp_audio_file.name, sr=AudioAnalyzer.SAMPLE_RATE)
+        
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+        if sr != AudioAnalyzer.SAMPLE_RATE:
+            y = librosa.resample(y, orig_sr=sr, target_sr=AudioAnalyzer.SAMPLE_RATE)
+        return y, AudioAnalyzer.SAMPLE_RATE
+    
+    @staticmethod
+    def analyze_audio(audio_data: bytes) -> Dict[str, Any]:
+        """Analyze encoded audio to extract beats and timing information"""
         try:
             # Load audio file
-            y, sr = librosa.load(audio_file_path)
+            y, sr = AudioAnalyzer.load_audio(audio_data)
             
-            # Get tempo and beat frames
-            tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
+            # Get duration
+            duration = len(y) / sr
+            
+            # Beat tracking only needs the onset envelope; drop the decoded samples right away
+            # so concurrent renders don't each hold a full song in memory
+            onset_envelope = librosa.onset.onset_strength(y=y, sr=sr)
+            del y
+            tempo, beat_frames = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr)
             
             # Convert beat frames to time
             beat_times = librosa.frames_to_time(beat_frames, sr=sr)
             
-            # Get duration
-            duration = librosa.get_duration(y=y, sr=sr)
-            
             return {
                 'tempo': float(tempo),
-                'beat_times': beat_times.tolist(),
+                'beat_times': beat_times,
                 'duration': float(duration),
-                'total_beats': len(beat_times),
-                'sample_rate': sr
+                'total_beats': len(beat_times)
             }
         except Exception as e:
             logger.error(f"Audio analysis failed: {str(e)}")
@@ -124,63 +261,107 @@ class AudioAnalyzer:
 
 class VideoCreator:
     @staticmethod
-    def create_video(image_urls: List[str], audio_file_path: str, beat_times: List[float], output_path: str) -> str:
-        """Create video by combining images and audio timed to beats"""
+    async def download_images(image_urls: List[str], max_concurrency: int = 16) -> List[bytes]:
+        """Download images concurrently into memory, skipping any that fail"""
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def fetch(session: aiohttp.ClientSession, i: int, url: str) -> Optional[bytes]:
+            async with semaphore:
+                try:
+                    async with session.get(url) as response:
+                        if response.status != 200:
+                            logger.warning(f"Failed to download image {i} from {url}")
+                            return None
+                        return await response.read()
+                except Exception as e:
+                    logger.warning(f"Failed to download image {i} from {url}: {str(e)}")
+                    return None
+        
+        connector = aiohttp.TCPConnector(limit=max_concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            images = await asyncio.gather(*[
+                fetch(session, i, url) for i, url in enumerate(image_urls) if url  # Skip None URLs
+            ])
+        return [image for image in images if image]
+    
+    @staticmethod
+    def image_durations(beat_times: np.ndarray, num_images: int, audio_duration: float) -> np.ndarray:
+        """Seconds each image stays on screen, with every cut landing on a beat"""
+        if len(beat_times) <= num_images:
+            # Too few beats to give each image its own: equal duration for all images
+            return np.full(num_images, audio_duration / num_images)
+        
+        # Spread the cuts evenly over the beats; the first and last slides run to the song's edges
+        bins = np.linspace(0, len(beat_times) - 1, num_images + 1).astype(int)
+        cuts = beat_times[bins]
+        cuts[0], cuts[-1] = 0.0, audio_duration
+        return np.diff(cuts)
+    
+    @staticmethod
+    def create_video(images: List[bytes], audio_data: bytes, beat_times: np.ndarray,
+                     output_path: str, audio_duration: float, workdir: str,
+                     frame_size: Tuple[int, int] = VIDEO_RESOLUTIONS['1080p']) -> str:
+        """Create video by combining downloaded images and audio timed to beats"""
         try:
-            # Download images to temporary files
-            temp_image_files = []
-            for i, url in enumerate(image_urls):
-                if url:  # Skip None URLs
-                    response = requests.get(url)
-                    if response.status_code == 200:
-                        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'_img_{i}.jpg')
-                        temp_file.write(response.content)
-                        temp_file.close()
-                        temp_image_files.append(temp_file.name)
-                    else:
-                        logger.warning(f"Failed to download image {i} from {url}")
-            
-            if not temp_image_files:
+            if not images:
                 raise Exception("No valid images to create video")
             
-            # Calculate duration for each image based on beats
-            if len(beat_times) > 1:
-                # Calculate average time between beats
-                beat_intervals = [beat_times[i+1] - beat_times[i] for i in range(len(beat_times)-1)]
-                avg_beat_interval = sum(beat_intervals) / len(beat_intervals)
-                
-                # Determine how many beats per image
-                beats_per_image = max(1, len(beat_times) // len(temp_image_files))
-                image_duration = avg_beat_interval * beats_per_image
-            else:
-                # Fallback: equal duration for all images
-                audio_clip = AudioFileClip(audio_file_path)
-                image_duration = audio_clip.duration / len(temp_image_files)
-                audio_clip.close()
+            durations = VideoCreator.image_durations(beat_times, len(images), audio_duration)
             
-            # Create video from images
-            video_clip = ImageSequenceClip(temp_image_files, durations=[image_duration] * len(temp_image_files))
+            # Slides have different lengths, so the images go to ffmpeg's concat demuxer with a
+            # duration per entry; the song streams in on a pipe
+            entries = []
+            for i, (image, duration) in enumerate(zip(images, durations)):
+                image_path = os.path.join(workdir, f"img_{i}")
+                with open(image_path, 'wb') as image_file:
+                    image_file.write(image)
+                entries.append(f"file '{image_path}'\nduration {duration:.6f}\n")
+            # The concat demuxer ignores the last entry's duration unless the file is listed again
+            entries.append(f"file '{image_path}'\n")
+            concat_path = os.path.join(workdir, 'slides.txt')
+            with open(concat_path, 'w') as concat_file:
+                concat_file.write(''.join(entries))
             
-            # Load audio
-            audio_clip = AudioFileClip(audio_file_path)
+            audio_read, audio_write = os.pipe()
+            width, height = frame_size
+            command = [
+                FFMPEG_BINARY, '-y', '-hide_banner', '-loglevel', 'error',
+                '-filter_threads', str(FFMPEG_THREADS),
+                '-f', 'concat', '-safe', '0', '-i', concat_path,
+                '-i', f"pipe:{audio_read}",
+                '-c:v', VIDEO_ENCODER, *ENCODER_PARAMS.get(VIDEO_ENCODER, []),
+                # The only resize step: fit each image into the frame once and pad the rest
+                '-vf', (f"scale={width}:{height}:force_original_aspect_ratio=decrease:flags=lanczos,"
+                        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,fps=24,format=yuv420p"),
+                '-c:a', 'aac', '-shortest', '-threads', str(FFMPEG_THREADS),
+                # Put the index at the front so players can start before the download finishes
+                '-movflags', '+faststart',
+                output_path
+            ]
+            try:
+                process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                           pass_fds=(audio_read,))
+            except Exception:
+                os.close(audio_write)
+                raise
+            finally:
+                os.close(audio_read)
             
-            # Combine video and audio
-            final_video = video_clip.set_audio(audio_clip)
+            # ffmpeg reads both inputs as it goes, so the song is written from its own thread
+            def write_audio():
+                try:
+                    with os.fdopen(audio_write, 'wb') as audio_pipe:
+                        audio_pipe.write(audio_data)
+                except BrokenPipeError:
+                    pass  # ffmpeg exited early; its stderr explains why
             
-            # Write video file
-            final_video.write_videofile(output_path, fps=24, codec='libx264', audio_codec='aac')
+            audio_writer = threading.Thread(target=write_audio, daemon=True)
+            audio_writer.start()
+            _, stderr = process.communicate()
+            audio_writer.join()
             
-            # Cleanup
-            video_clip.close()
-            audio_clip.close()
-            final_video.close()
-            
-            # Remove temporary image files
-            for temp_file in temp_image_files:
-                try:
-                    os.unlink(temp_file)
-                except:
-                    pass
+            if process.returncode != 0:
+                raise Exception(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
             
             return output_path
             
@@ -188,6 +369,142 @@ class VideoCreator:
             logger.error(f"Video creation failed: {str(e)}")
             raise
 
+@celery_app.task(bind=True, name='phase3_worker.render_song_video')
+def render_song_video(self, session_id: str, index: int, music_file: Dict[str, Any],
+                      preferences: Dict[str, Any], total: int) -> Dict[str, Any]:
+    """Render and upload the video for one Phase 2 song"""
+    try:
+        logger.info(f"Processing video {index+1}/{total} for session {session_id}")
+        
+        # Download the song into memory; analysis and ffmpeg both read it from there.
+        # Songs Phase 2 couldn't store in GCS only have their Suno URL
+        if music_file.get('filename'):
+            audio_data = bucket.blob(music_file['filename']).download_as_bytes()
+        else:
+            response = requests.get(music_file['audio_url'], timeout=120)
+            response.raise_for_status()
+            audio_data = response.content
+        
+        # Analyze audio
+        audio_analysis = AudioAnalyzer.analyze_audio(audio_data)
+        
+        # Calculate number of images needed (one image per 4 beats or minimum 8 images)
+        beats_per_image = 4
+        num_images = max(8, audio_analysis['total_beats'] // beats_per_image)
+        
+        # Generate image prompts using Gemini
+        video_preferences = preferences.get('video', {})
+        
+        # Generate images close to the output frame size so ffmpeg resamples them only slightly
+        resolution = preferences.get('video_preferences', {}).get('resolution', '1080p')
+        frame_size = VIDEO_RESOLUTIONS.get(resolution, VIDEO_RESOLUTIONS['1080p'])
+        image_width, image_height = runware_image_size(*frame_size)
+        base_prompt = video_preferences.get('style', 'cinematic music video')
+        
+        image_prompts = []
+        for j in range(num_images):
+            # Create varied prompts for different scenes
+            scene_prompt = f"{base_prompt}, scene {j+1}, high quality, 4K, professional"
+            if j % 3 == 0:
+                scene_prompt += ", wide shot"
+            elif j % 3 == 1:
+                scene_prompt += ", close-up"
+            else:
+                scene_prompt += ", medium shot"
+        
+            image_prompts.append(scene_prompt)
+        
+        # Generate images using Runware over this process's shared connection
+        async def generate_images():
+            runware_service = await get_runware_service()
+            image_urls = await runware_service.generate_images_batch(image_prompts, image_width, image_height)
+            if not any(image_urls):
+                # A dropped connection fails every request; reconnect for the next song
+                await reset_runware_service()
+            return image_urls
+        
+        # Run async image generation, then fetch the images concurrently on the same loop
+        loop = get_event_loop()
+        image_urls = loop.run_until_complete(generate_images())
+        
+        # Filter out failed images
+        valid_image_urls = [url for url in image_urls if url is not None]
+        
+        if len(valid_image_urls) < 4:  # Minimum viable images
+            raise Exception(f"Too few images generated: {len(valid_image_urls)}/{num_images}")
+        
+        images = loop.run_until_complete(VideoCreator.download_images(valid_image_urls))
+        
+        # Create video in a per-task scratch directory that is removed even if a step fails
+        video_filename = f"video_{session_id}_{index+1}.mp4"
+        with tempfile.TemporaryDirectory() as workdir:
+            temp_video_path = os.path.join(workdir, video_filename)
+            
+            VideoCreator.create_video(
+                images,
+                audio_data,
+                audio_analysis['beat_times'],
+                temp_video_path,
+                audio_analysis['duration'],
+                workdir,
+                frame_size
+            )
+            
+            # Upload video to GCS
+            # Resumable upload in 8 MB chunks, verified with CRC32C rather than MD5
+            video_blob = bucket.blob(f"videos/{session_id}/{video_filename}", chunk_size=VIDEO_UPLOAD_CHUNK_SIZE)
+            video_blob.upload_from_filename(
+                temp_video_path,
+                content_type='video/mp4',
+                predefined_acl=None if uniform_access else 'publicRead',
+                checksum='crc32c'
+            )
+        
+        video_result = {
+            'video_id': f"video_{index+1}",
+            'gcs_path': f"videos/{session_id}/{video_filename}",
+            'download_url': video_blob.public_url,
+            'duration': audio_analysis['duration'],
+            'images_used': len(images),
+            'tempo': audio_analysis['tempo']
+        }
+        
+        # Songs finish in any order, so progress counts completed videos
+        record_video_done(keys=[f"session:{session_id}"], args=[total])
+        
+        return video_result
+        
+    except Exception as e:
+        logger.error(f"Phase 3 video {index+1} failed for session {session_id}: {str(e)}")
+        redis_client.hset(f"session:{session_id}", mapping={"phase3_status": "failed", "phase3_error": str(e)})
+        raise
+
+@celery_app.task(bind=True, name='phase3_worker.finalize_video_generation')
+def finalize_video_generation(self, video_results: List[Dict[str, Any]], session_id: str) -> Dict[str, Any]:
+    """Store the rendered videos once every song's render task has finished"""
+    # Store results
+    phase3_results = {
+        'videos': video_results,
+        'session_id': session_id,
+        'generated_at': datetime.now(timezone.utc).isoformat()
+    }
+    
+    # Store the results and publish the completion event in one round-trip
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hset(f"session:{session_id}", mapping={
+            "phase3_results": orjson.dumps(phase3_results),
+            "phase3_status": "completed",
+            "phase3_progress": "100"
+        })
+        pipe.publish('phase3_complete', orjson.dumps({
+            'session_id': session_id,
+            'video_count': len(video_results)
+        }))
+        pipe.execute()
+    
+    logger.info(f"Phase 3 completed for session {session_id}. Generated {len(video_results)} videos.")
+    return phase3_results
+
 @celery_app.task(bind=True, name='phase3_worker.process_video_generation')
 def process_video_generation(self, session_id: str):
     """Phase 3: Generate video from music and preferences"""
@@ -195,8 +512,11 @@ def process_video_generation(self, session_id: str):
         logger.info(f"Starting Phase 3 video generation for session {session_id}")
         
         # Update status
-        redis_client.hset(f"session:{session_id}", "phase3_status", "processing")
-        redis_client.hset(f"session:{session_id}", "phase3_progress", "0")
+        redis_client.hset(f"session:{session_id}", mapping={
+            "phase3_status": "processing",
+            "phase3_progress": "0",
+            "phase3_videos_done": "0"
+        })
         
         # Get session data
         preferences = session_manager.get_preferences(session_id)
@@ -208,132 +528,25 @@ def process_video_generation(self, session_id: str):
         if not phase2_results:
             raise Exception("No Phase 2 results found")
         
-        phase2_data = json.loads(phase2_results)
-        music_files = phase2_data.get('music_files', [])
+        phase2_data = orjson.loads(phase2_results)
+        music_files = phase2_data.get('songs', [])
         
         if not music_files:
             raise Exception("No music files found from Phase 2")
         
-        # Process each generated song
-        video_results = []
-        
-        for i, music_file in enumerate(music_files):
-            logger.info(f"Processing video {i+1}/{len(music_files)}")
-            
-            # Update progress
-            progress = int((i / len(music_files)) * 100)
-            redis_client.hset(f"session:{session_id}", "phase3_progress", str(progress))
-            
-            # Download music file from GCS
-            blob = bucket.blob(music_file['gcs_path'])
-            temp_audio_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-            blob.download_to_filename(temp_audio_file.name)
-            
-            try:
-                # Analyze audio
-                audio_analysis = AudioAnalyzer.analyze_audio(temp_audio_file.name)
-                
-                # Calculate number of images needed (one image per 4 beats or minimum 8 images)
-                beats_per_image = 4
-                num_images = max(8, audio_analysis['total_beats'] // beats_per_image)
-                
-                # Generate image prompts using Gemini
-                video_preferences = preferences.get('video', {})
-                base_prompt = video_preferences.get('style', 'cinematic music video')
-                
-                image_prompts = []
-                for j in range(num_images):
-                    # Create varied prompts for different scenes
-                    scene_prompt = f"{base_prompt}, scene {j+1}, high quality, 4K, professional"
-                    if j % 3 == 0:
-                        scene_prompt += ", wide shot"
-                    elif j % 3 == 1:
-                        scene_prompt += ", close-up"
-                    else:
-                        scene_prompt += ", medium shot"
-                    
-                    image_prompts.append(scene_prompt)
-                
-                # Generate images using Runware
-                runware_service = RunwareService()
-                
-                async def generate_images():
-                    await runware_service.connect()
-                    try:
-                        image_urls = await runware_service.generate_images_batch(image_prompts)
-                        return image_urls
-                    finally:
-                        await runware_service.disconnect()
-                
-                # Run async image generation
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                image_urls = loop.run_until_complete(generate_images())
-                loop.close()
-                
-                # Filter out failed images
-                valid_image_urls = [url for url in image_urls if url is not None]
-                
-                if len(valid_image_urls) < 4:  # Minimum viable images
-                    raise Exception(f"Too few images generated: {len(valid_image_urls)}/{num_images}")
-                
-                # Create video
-                video_filename = f"video_{session_id}_{i+1}.mp4"
-                temp_video_path = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4').name
-                
-                VideoCreator.create_video(
-                    valid_image_urls,
-                    temp_audio_file.name,
-                    audio_analysis['beat_times'],
-                    temp_video_path
-                )
-                
-                # Upload video to GCS
-                video_blob = bucket.blob(f"videos/{session_id}/{video_filename}")
-                video_blob.upload_from_filename(temp_video_path)
-                
-                video_result = {
-                    'video_id': f"video_{i+1}",
-                    'gcs_path': f"videos/{session_id}/{video_filename}",
-                    'download_url': video_blob.public_url,
-                    'duration': audio_analysis['duration'],
-                    'images_used': len(valid_image_urls),
-                    'tempo': audio_analysis['tempo']
-                }
-                
-                video_results.append(video_result)
-                
-                # Cleanup temporary files
-                os.unlink(temp_video_path)
-                
-            finally:
-                # Cleanup audio file
-                os.unlink(temp_audio_file.name)
-        
-        # Store results
-        phase3_results = {
-            'videos': video_results,
-            'session_id': session_id,
-            'generated_at': str(asyncio.get_event_loop().time())
-        }
-        
-        redis_client.hset(f"session:{session_id}", "phase3_results", json.dumps(phase3_results))
-        redis_client.hset(f"session:{session_id}", "phase3_status", "completed")
-        redis_client.hset(f"session:{session_id}", "phase3_progress", "100")
-        
-        # Publish completion event
-        redis_client.publish('phase3_complete', json.dumps({
-            'session_id': session_id,
-            'video_count': len(video_results)
-        }))
+        # Songs are independent, so render them in parallel across the video workers
+        # and collect the results once all of them have finished
+        render_tasks = group(
+            render_song_video.s(session_id, i, music_file, preferences, len(music_files))
+            for i, music_file in enumerate(music_files)
+        )
+        chord(render_tasks)(finalize_video_generation.s(session_id))
         
-        logger.info(f"Phase 3 completed for session {session_id}. Generated {len(video_results)} videos.")
-        return phase3_results
+        return {'session_id': session_id, 'videos_queued': len(music_files)}
         
     except Exception as e:
         logger.error(f"Phase 3 failed for session {session_id}: {str(e)}")
-        redis_client.hset(f"session:{session_id}", "phase3_status", "failed")
-        redis_client.hset(f"session:{session_id}", "phase3_error", str(e))
+        redis_client.hset(f"session:{session_id}", mapping={"phase3_status": "failed", "phase3_error": str(e)})
         raise
 
 if __name__ == '__main__':
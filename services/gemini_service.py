@@ -1,31 +1,156 @@
-import google.generativeai as genai
 import os
 import logging
-from typing import Dict, Any, Optional, List
-import json
-import re
+from typing import Dict, Any, Optional, List, TypedDict
+import hashlib
+import threading
+from concurrent.futures import Future
+import msgspec
+from string import Template
 
 logger = logging.getLogger(__name__)
 
+# Cached Gemini responses live for a day
+CACHE_TTL = 86400
+
+# Upper bound on the length of a Gemini reply
+MAX_OUTPUT_TOKENS = int(os.environ.get('GEMINI_MAX_OUTPUT_TOKENS', 1024))
+# JSON replies are only usable when complete, so they get more room before the cut-off
+JSON_MAX_OUTPUT_TOKENS = int(os.environ.get('GEMINI_JSON_MAX_OUTPUT_TOKENS', 2048))
+
+# Deterministic key order so equal preference dicts hash to the same key
+_key_encoder = msgspec.msgpack.Encoder(order='deterministic')
+
+# Case, runs of whitespace and trailing punctuation don't change what Gemini returns.
+# Requests folded onto one key share Gemini's output only: cached values never hold
+# anything echoed from the caller's input, which is added back on every hit
+_TRAILING_PUNCTUATION = ' .!?,;:'
+
+def _normalize_for_key(value: Any) -> Any:
+    """Fold cosmetic differences out of cache key inputs so near-identical requests share an entry"""
+    if isinstance(value, str):
+        return ' '.join(value.lower().split()).rstrip(_TRAILING_PUNCTUATION)
+    if isinstance(value, dict):
+        return {key: _normalize_for_key(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_for_key(item) for item in value]
+    return value
+
+# Response schemas: Gemini replies with JSON matching these, so no text parsing is needed
+class VideoEnhancement(TypedDict):
+    enhanced_prompt: str
+    alternatives: List[str]
+    technical_notes: str
+
+class VideoSuggestion(TypedDict):
+    title: str
+    description: str
+
+class VideoSuggestions(TypedDict):
+    suggestions: List[VideoSuggestion]
+
+class MusicEnhancement(TypedDict):
+    enhanced_prompt: str
+    technical_terms: List[str]
+    alternatives: List[str]
+
+# Prompt templates are built once at import; each call only substitutes the user's values
+_VIDEO_PROMPT = Template("""\
+You are a creative video prompt expert. Help enhance this video description for AI video generation.
+
+User's current input: "$user_input"
+
+Their preferences as JSON: $context_json
+
+Please provide an enhanced version of their prompt that is more detailed and creative.
+Also provide 3 alternative creative suggestions.
+Include technical improvements for better AI video generation as technical notes.
+
+Your response should be creative, detailed, and optimized for AI video generation systems.
+""")
+
+_SUGGESTIONS_PROMPT = Template("""\
+Based on these music and video preferences, create 5 creative video concepts that would work perfectly together:
+
+Preferences as JSON (duration in seconds): $context_json
+
+Please provide 5 creative, detailed video concepts, each with a creative title and a 2-3 sentence description of a unique visual narrative and style that matches these preferences.
+
+Make them diverse and creative while staying true to the user's preferences.
+""")
+
+_MUSIC_PROMPT = Template("""\
+You are a music production expert. Help enhance this music description for AI music generation.
+
+User's input: "$user_input"
+
+Music preferences:
+- Genre: $genre
+- Mood: $mood
+- Tempo: $tempo
+- Energy Level: $energy_level
+- Instruments: $instruments
+
+Please provide:
+1. An enhanced music prompt optimized for AI generation
+2. Technical music terms that would improve the output
+3. 3 alternative approaches for the same concept
+
+Make the enhanced prompt detailed, using proper music terminology and production language.
+""")
+
+_IMAGE_PROMPT = Template("""\
+Create a realistic image prompt for AI image generation.
+
+User's idea: "$user_input"
+Music: $genre - $mood
+Style: $visual_style
+Colors: $color_scheme
+
+Create a realistic, specific image prompt under 1500 characters that describes something real and achievable.
+""")
+
 class GeminiService:
     """Service for interacting with Google Gemini AI for prompt enhancement and suggestions"""
     
-    def __init__(self):
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_client
+        # Gemini calls in progress, keyed by prompt and response mode, so identical concurrent requests share one
+        self._inflight: Dict[bytes, Future] = {}
+        self._inflight_lock = threading.Lock()
         self.api_key = os.environ.get('GEMINI_API_KEY')
         if not self.api_key:
             logger.warning("GEMINI_API_KEY not found in environment variables")
             self.model = None
             return
             
+        self.model_name = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash-002')
         try:
+            # The SDK is slow to import, so processes without an API key never load it
+            import google.generativeai as genai
+            
             genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-pro-002')
-            logger.info("Gemini service initialized with gemini-1.5-pro-002")
+            # Every reply is parsed down to a paragraph and a few short lists; capping the
+            # length stops long generations from adding seconds of tail latency
+            self.model = genai.GenerativeModel(
+                self.model_name,
+                generation_config={'max_output_tokens': MAX_OUTPUT_TOKENS}
+            )
+            logger.info(f"Gemini service initialized with {self.model_name}")
         except Exception as e:
             logger.error(f"Failed to initialize Gemini: {e}")
             self.model = None
+    
+    def warm_up(self) -> None:
+        """Issue a one-token request so the first user call doesn't pay for connection setup"""
+        if not self.model:
+            return
+        try:
+            self.model.generate_content('ping', generation_config={'max_output_tokens': 1})
+            logger.info("Gemini model warmed up")
+        except Exception as e:
+            logger.warning(f"Gemini warm-up failed: {e}")
         
-    def enhance_video_prompt(self, user_input: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
+    def enhance_video_prompt(self, user_input: str, preferences: Dict[str, Any], bypass_cache: bool = False) -> Dict[str, Any]:
         """Enhance user's video prompt with AI suggestions"""
         try:
             if not self.model:
@@ -33,66 +158,39 @@ class GeminiService:
                     'success': False, 
                     'error': 'Gemini API not configured properly'
                 }
-                
-            # Create context from user preferences
-            context = self._build_context(preferences)
-            
-            prompt = f"""
-            You are a creative video prompt expert. Help enhance this video description for AI video generation.
-            
-            User's current input: "{user_input}"
-            
-            Context from their preferences:
-            - Genre: {preferences.get('music_preferences', {}).get('genre', 'Not specified')}
-            - Mood: {preferences.get('music_preferences', {}).get('mood', 'Not specified')}
-            - Visual Style: {preferences.get('video_preferences', {}).get('visual_style', 'Not specified')}
-            - Color Scheme: {preferences.get('video_preferences', {}).get('color_scheme', 'Not specified')}
-            - Themes: {', '.join(preferences.get('video_preferences', {}).get('themes', []))}
             
-            Please provide an enhanced version of their prompt that is more detailed and creative.
-            Also provide 3 alternative creative suggestions.
-            Include technical improvements for better AI video generation.
-            
-            Your response should be creative, detailed, and optimized for AI video generation systems.
-            """
-            
-            response = self.model.generate_content(prompt)
-            
-            # Parse response and extract parts
-            response_text = response.text
-            
-            # Try to extract enhanced prompt (usually the first substantial paragraph)
-            lines = response_text.split('\n')
-            enhanced_prompt = ""
-            alternatives = []
-            technical_notes = ""
-            
-            current_section = "enhanced"
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                if "alternative" in line.lower() or "suggestion" in line.lower():
-                    current_section = "alternatives"
-                    continue
-                elif "technical" in line.lower() or "improvement" in line.lower():
-                    current_section = "technical"
-                    continue
+            cache_key = self._cache_key(
+                'enhance_video_prompt',
+                user_input,
+                preferences.get('music_preferences', {}),
+                preferences.get('video_preferences', {})
+            )
+            cached = None if bypass_cache else self._get_cached(cache_key)
+            if cached:
+                return {**cached, 'original_prompt': user_input}
                 
-                if current_section == "enhanced" and not enhanced_prompt:
-                    enhanced_prompt = line
-                elif current_section == "alternatives" and line:
-                    if line.startswith(('-', '•', '1.', '2.', '3.')):
-                        alternatives.append(line.lstrip('-•123. '))
-                    elif len(alternatives) < 3 and len(line) > 20:
-                        alternatives.append(line)
-                elif current_section == "technical":
-                    technical_notes += line + " "
-            
-            # Fallback if parsing fails
-            if not enhanced_prompt:
-                enhanced_prompt = response_text[:200] + "..."
+            music_prefs = preferences.get('music_preferences', {})
+            video_prefs = preferences.get('video_preferences', {})
+            context_json = self._compact_context(
+                genre=music_prefs.get('genre'),
+                mood=music_prefs.get('mood'),
+                visual_style=video_prefs.get('visual_style'),
+                color_scheme=video_prefs.get('color_scheme'),
+                themes=video_prefs.get('themes')
+            )
+            
+            prompt = _VIDEO_PROMPT.substitute(user_input=user_input, context_json=context_json)
+            
+            data = self._generate_json(prompt, VideoEnhancement)
+            enhanced_prompt = data.get('enhanced_prompt', '').strip()
+            alternatives = [item for item in data.get('alternatives', []) if item]
+            technical_notes = data.get('technical_notes', '')
+            
+            # Only a reply whose prompt came from the JSON call is worth caching
+            from_gemini = bool(enhanced_prompt)
+            if not from_gemini:
+                # No usable JSON reply; fall back to plain text, as before structured output
+                enhanced_prompt = self._generate_text(prompt)[:200] + "..."
             
             if not alternatives:
                 alternatives = [
@@ -101,13 +199,15 @@ class GeminiService:
                     "Layered visual effects with synchronized transitions"
                 ]
             
-            return {
+            result = {
                 'success': True,
                 'enhanced_prompt': enhanced_prompt,
                 'alternatives': alternatives[:3],
-                'technical_notes': technical_notes.strip() or "AI-enhanced prompt generated for optimal video creation",
-                'original_prompt': user_input
+                'technical_notes': technical_notes.strip() or "AI-enhanced prompt generated for optimal video creation"
             }
+            if from_gemini:
+                self._set_cached(cache_key, result)
+            return {**result, 'original_prompt': user_input}
             
         except Exception as e:
             logger.error(f"Error enhancing video prompt: {e}")
@@ -116,7 +216,7 @@ class GeminiService:
                 'error': f'Gemini API error: {str(e)}'
             }
     
-    def generate_video_suggestions(self, preferences: Dict[str, Any]) -> Dict[str, Any]:
+    def generate_video_suggestions(self, preferences: Dict[str, Any], bypass_cache: bool = False) -> Dict[str, Any]:
         """Generate video concept suggestions based on user preferences"""
         try:
             if not self.model:
@@ -124,71 +224,41 @@ class GeminiService:
                     'success': False, 
                     'error': 'Gemini API not configured properly'
                 }
-                
-            context = self._build_context(preferences)
-            
-            prompt = f"""
-            Based on these music and video preferences, create 5 creative video concepts that would work perfectly together:
-            
-            Music Details:
-            - Genre: {preferences.get('music_preferences', {}).get('genre', 'Pop')}
-            - Mood: {preferences.get('music_preferences', {}).get('mood', 'Upbeat')}
-            - Tempo: {preferences.get('music_preferences', {}).get('tempo', 'Medium')}
-            - Duration: {preferences.get('music_preferences', {}).get('duration', 60)} seconds
             
-            Video Preferences:
-            - Visual Style: {preferences.get('video_preferences', {}).get('visual_style', 'Modern')}
-            - Color Scheme: {preferences.get('video_preferences', {}).get('color_scheme', 'Vibrant')}
-            - Animation Style: {preferences.get('video_preferences', {}).get('animation_style', 'Smooth')}
-            - Resolution: {preferences.get('video_preferences', {}).get('resolution', '1080p')}
-            
-            Please provide 5 creative, detailed video concepts. Each concept should be 2-3 sentences describing a unique visual narrative and style that matches these preferences.
-            
-            Format each suggestion as:
-            Title: [Creative Title]
-            Description: [2-3 sentence description]
-            
-            Make them diverse and creative while staying true to the user's preferences.
-            """
-            
-            response = self.model.generate_content(prompt)
-            response_text = response.text
-            
-            # Parse suggestions
-            suggestions = []
-            lines = response_text.split('\n')
-            current_title = ""
-            current_description = ""
-            
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                if line.lower().startswith('title:') or line.lower().startswith('1.') or line.lower().startswith('2.') or line.lower().startswith('3.') or line.lower().startswith('4.') or line.lower().startswith('5.'):
-                    if current_title and current_description:
-                        suggestions.append({
-                            'title': current_title,
-                            'description': current_description
-                        })
-                    current_title = line.replace('Title:', '').replace('1.', '').replace('2.', '').replace('3.', '').replace('4.', '').replace('5.', '').strip()
-                    current_description = ""
-                elif line.lower().startswith('description:'):
-                    current_description = line.replace('Description:', '').strip()
-                elif current_title and not current_description:
-                    current_description = line
-                elif current_title and current_description and len(line) > 20:
-                    current_description += " " + line
-            
-            # Add the last suggestion
-            if current_title and current_description:
-                suggestions.append({
-                    'title': current_title,
-                    'description': current_description
-                })
+            cache_key = self._cache_key(
+                'generate_video_suggestions',
+                preferences.get('music_preferences', {}),
+                preferences.get('video_preferences', {})
+            )
+            cached = None if bypass_cache else self._get_cached(cache_key)
+            if cached:
+                return cached
+                
+            music_prefs = preferences.get('music_preferences', {})
+            video_prefs = preferences.get('video_preferences', {})
+            context_json = self._compact_context(
+                genre=music_prefs.get('genre', 'pop'),
+                mood=music_prefs.get('mood', 'upbeat'),
+                tempo=music_prefs.get('tempo', 'medium'),
+                duration=music_prefs.get('duration', 60),
+                visual_style=video_prefs.get('visual_style', 'modern'),
+                color_scheme=video_prefs.get('color_scheme', 'vibrant'),
+                animation_style=video_prefs.get('animation_style', 'smooth'),
+                resolution=video_prefs.get('resolution', '1080p')
+            )
+            
+            prompt = _SUGGESTIONS_PROMPT.substitute(context_json=context_json)
+            
+            data = self._generate_json(prompt, VideoSuggestions)
+            suggestions = [
+                {'title': item.get('title', '').strip(), 'description': item.get('description', '').strip()}
+                for item in data.get('suggestions', [])
+                if item.get('title') and item.get('description')
+            ]
             
-            # Fallback if parsing fails
-            if not suggestions:
+            # Fallback if Gemini returned no usable concepts
+            from_gemini = bool(suggestions)
+            if not from_gemini:
                 suggestions = [
                     {
                         'title': 'Dynamic Visual Journey',
@@ -204,10 +274,13 @@ class GeminiService:
                     }
                 ]
             
-            return {
+            result = {
                 'success': True,
                 'suggestions': suggestions[:5]
             }
+            if from_gemini:
+                self._set_cached(cache_key, result)
+            return result
             
         except Exception as e:
             logger.error(f"Error generating video suggestions: {e}")
@@ -216,7 +289,7 @@ class GeminiService:
                 'error': f'Gemini API error: {str(e)}'
             }
     
-    def enhance_music_prompt(self, user_input: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
+    def enhance_music_prompt(self, user_input: str, preferences: Dict[str, Any], bypass_cache: bool = False) -> Dict[str, Any]:
         """Enhance user's music prompt for better Suno generation"""
         try:
             if not self.model:
@@ -227,64 +300,30 @@ class GeminiService:
                 
             music_prefs = preferences.get('music_preferences', {})
             
-            prompt = f"""
-            You are a music production expert. Help enhance this music description for AI music generation.
-            
-            User's input: "{user_input}"
-            
-            Music preferences:
-            - Genre: {music_prefs.get('genre', 'Not specified')}
-            - Mood: {music_prefs.get('mood', 'Not specified')}
-            - Tempo: {music_prefs.get('tempo', 'Not specified')}
-            - Energy Level: {music_prefs.get('energy_level', 'Not specified')}
-            - Instruments: {', '.join(music_prefs.get('instruments', []))}
-            
-            Please provide:
-            1. An enhanced music prompt optimized for AI generation
-            2. Technical music terms that would improve the output
-            3. 3 alternative approaches for the same concept
-            
-            Make the enhanced prompt detailed, using proper music terminology and production language.
-            """
-            
-            response = self.model.generate_content(prompt)
-            response_text = response.text
-            
-            # Parse the response
-            lines = response_text.split('\n')
-            enhanced_prompt = ""
-            technical_terms = []
-            alternatives = []
-            
-            current_section = "enhanced"
-            
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                if "technical" in line.lower() or "terms" in line.lower():
-                    current_section = "technical"
-                    continue
-                elif "alternative" in line.lower() or "approach" in line.lower():
-                    current_section = "alternatives"
-                    continue
-                
-                if current_section == "enhanced" and not enhanced_prompt:
-                    if len(line) > 20 and not line.startswith(('1.', '2.', '3.')):
-                        enhanced_prompt = line
-                elif current_section == "technical":
-                    if line.startswith(('-', '•')) or len(line) > 10:
-                        technical_terms.append(line.lstrip('-• '))
-                elif current_section == "alternatives":
-                    if line.startswith(('-', '•', '1.', '2.', '3.')):
-                        alternatives.append(line.lstrip('-•123. '))
-                    elif len(alternatives) < 3 and len(line) > 20:
-                        alternatives.append(line)
-            
-            # Fallback if parsing fails
-            if not enhanced_prompt:
-                enhanced_prompt = response_text[:150] + "..."
+            cache_key = self._cache_key('enhance_music_prompt', user_input, music_prefs)
+            cached = None if bypass_cache else self._get_cached(cache_key)
+            if cached:
+                return {**cached, 'original_prompt': user_input}
+            
+            prompt = _MUSIC_PROMPT.substitute(
+                user_input=user_input,
+                genre=music_prefs.get('genre', 'Not specified'),
+                mood=music_prefs.get('mood', 'Not specified'),
+                tempo=music_prefs.get('tempo', 'Not specified'),
+                energy_level=music_prefs.get('energy_level', 'Not specified'),
+                instruments=', '.join(music_prefs.get('instruments', []))
+            )
+            
+            data = self._generate_json(prompt, MusicEnhancement)
+            enhanced_prompt = data.get('enhanced_prompt', '').strip()
+            technical_terms = [item for item in data.get('technical_terms', []) if item]
+            alternatives = [item for item in data.get('alternatives', []) if item]
+            
+            # Only a reply whose prompt came from the JSON call is worth caching
+            from_gemini = bool(enhanced_prompt)
+            if not from_gemini:
+                # No usable JSON reply; fall back to plain text, as before structured output
+                enhanced_prompt = self._generate_text(prompt)[:150] + "..."
             
             if not alternatives:
                 alternatives = [
@@ -293,13 +332,15 @@ class GeminiService:
                     f"Create atmospheric {music_prefs.get('genre', 'contemporary')} soundscape"
                 ]
             
-            return {
+            result = {
                 'success': True,
                 'enhanced_prompt': enhanced_prompt,
                 'technical_terms': technical_terms[:5],
-                'alternatives': alternatives[:3],
-                'original_prompt': user_input
+                'alternatives': alternatives[:3]
             }
+            if from_gemini:
+                self._set_cached(cache_key, result)
+            return {**result, 'original_prompt': user_input}
             
         except Exception as e:
             logger.error(f"Error enhancing music prompt: {e}")
@@ -308,7 +349,7 @@ class GeminiService:
                 'error': f'Gemini API error: {str(e)}'
             }
     
-    def enhance_image_prompt(self, user_input: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
+    def enhance_image_prompt(self, user_input: str, preferences: Dict[str, Any], bypass_cache: bool = False) -> Dict[str, Any]:
         """Enhance user's image prompt with AI suggestions"""
         try:
             if not self.model:
@@ -320,37 +361,26 @@ class GeminiService:
             music_prefs = preferences.get('music_preferences', {})
             image_prefs = preferences.get('image_preferences', {})
             
-            prompt = f"""
-            Create a realistic image prompt for AI image generation.
+            cache_key = self._cache_key('enhance_image_prompt', user_input, music_prefs, image_prefs)
+            cached = None if bypass_cache else self._get_cached(cache_key)
+            if cached:
+                return self._image_result(cached['enhanced_prompt'], user_input, music_prefs, image_prefs)
             
-            User's idea: \"{user_input}\"
-            Music: {music_prefs.get('genre', 'pop')} - {music_prefs.get('mood', 'upbeat')}
-            Style: {image_prefs.get('visual_style', 'modern')}
-            Colors: {image_prefs.get('color_scheme', 'vibrant')}
+            prompt = _IMAGE_PROMPT.substitute(
+                user_input=user_input,
+                genre=music_prefs.get('genre', 'pop'),
+                mood=music_prefs.get('mood', 'upbeat'),
+                visual_style=image_prefs.get('visual_style', 'modern'),
+                color_scheme=image_prefs.get('color_scheme', 'vibrant')
+            )
             
-            Create a realistic, specific image prompt under 1500 characters that describes something real and achievable.
-            """
-            
-            response = self.model.generate_content(prompt)
-            response_text = response.text
+            response_text = self._generate_text(prompt)
             
             # Extract the main enhanced prompt
             enhanced_prompt = response_text.strip()
             
-            # Generate alternative suggestions
-            alternatives = [
-                f"Focus on {image_prefs.get('visual_style', 'modern')} style: {user_input}",
-                f"Emphasize {image_prefs.get('color_scheme', 'vibrant')} colors: {user_input}",
-                f"Match {music_prefs.get('mood', 'upbeat')} mood: {user_input}"
-            ]
-            
-            return {
-                'success': True,
-                'enhanced_prompt': enhanced_prompt,
-                'alternatives': alternatives,
-                'original_prompt': user_input,
-                'character_count': len(enhanced_prompt)
-            }
+            self._set_cached(cache_key, {'success': True, 'enhanced_prompt': enhanced_prompt})
+            return self._image_result(enhanced_prompt, user_input, music_prefs, image_prefs)
             
         except Exception as e:
             logger.error(f"Error enhancing image prompt: {e}")
@@ -359,16 +389,98 @@ class GeminiService:
                 'error': f'Gemini API error: {str(e)}'
             }
     
-    def _build_context(self, preferences: Dict[str, Any]) -> str:
-        """Build context string from user preferences"""
-        context_parts = []
+    def _image_result(self, enhanced_prompt: str, user_input: str,
+                      music_prefs: Dict[str, Any], image_prefs: Dict[str, Any]) -> Dict[str, Any]:
+        """Wrap an enhanced image prompt with the fields built from this caller's own input"""
+        # Generate alternative suggestions
+        alternatives = [
+            f"Focus on {image_prefs.get('visual_style', 'modern')} style: {user_input}",
+            f"Emphasize {image_prefs.get('color_scheme', 'vibrant')} colors: {user_input}",
+            f"Match {music_prefs.get('mood', 'upbeat')} mood: {user_input}"
+        ]
         
-        if 'music_preferences' in preferences:
-            music = preferences['music_preferences']
-            context_parts.append(f"Music: {music.get('genre', '')} {music.get('mood', '')}")
+        return {
+            'success': True,
+            'enhanced_prompt': enhanced_prompt,
+            'alternatives': alternatives,
+            'original_prompt': user_input,
+            'character_count': len(enhanced_prompt)
+        }
+    
+    def _generate_json(self, prompt: str, schema: type) -> Dict[str, Any]:
+        """Call Gemini for a JSON reply and decode it into schema; {} if the reply doesn't match it"""
+        text = self._generate_text(prompt, schema)
+        try:
+            return msgspec.json.decode(text, type=schema)
+        except msgspec.DecodeError as e:
+            logger.warning(f"Gemini returned unusable JSON ({len(text)} chars): {e}")
+            return {}
+    
+    def _generate_text(self, prompt: str, schema: Optional[type] = None) -> str:
+        """Call Gemini for a prompt, joining an identical call already in flight instead of repeating it"""
+        # JSON and plain-text calls for the same prompt get different replies, so the mode is part of the key
+        mode = schema.__name__ if schema is not None else ''
+        key = hashlib.blake2b(prompt.encode() + b'\0' + mode.encode(), digest_size=16).digest()
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
         
-        if 'video_preferences' in preferences:
-            video = preferences['video_preferences']
-            context_parts.append(f"Video: {video.get('visual_style', '')} {video.get('color_scheme', '')}")
+        if not leader:
+            return future.result()
         
-        return " | ".join(context_parts)
+        try:
+            generation_config = None
+            if schema is not None:
+                generation_config = {
+                    'response_mime_type': 'application/json',
+                    'response_schema': schema,
+                    'max_output_tokens': JSON_MAX_OUTPUT_TOKENS
+                }
+            response = self.model.generate_content(prompt, generation_config=generation_config)
+            finish_reason = getattr(response.candidates[0].finish_reason, 'name', None) if response.candidates else None
+            if finish_reason == 'MAX_TOKENS':
+                logger.warning("Gemini reply was cut off at the output token limit")
+            text = response.text
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+    
+    def _cache_key(self, method: str, *parts: Any) -> str:
+        """Build a content-addressed cache key from the method name and its normalized inputs"""
+        normalized = tuple(_normalize_for_key(part) for part in parts)
+        digest = hashlib.blake2b(_key_encoder.encode((method,) + normalized), digest_size=16).hexdigest()
+        return f"gemini:{digest}"
+    
+    def _get_cached(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached Gemini result, or None on miss or when Redis is unavailable"""
+        if not self.redis_client:
+            return None
+        try:
+            cached = self.redis_client.get(key)
+            if cached:
+                return msgspec.msgpack.decode(cached)
+        except Exception as e:
+            logger.warning(f"Gemini cache read failed: {e}")
+        return None
+    
+    def _set_cached(self, key: str, result: Dict[str, Any]) -> None:
+        """Store a successful Gemini result in Redis"""
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.setex(key, CACHE_TTL, msgspec.msgpack.encode(result))
+        except Exception as e:
+            logger.warning(f"Gemini cache write failed: {e}")
+    
+    def _compact_context(self, **fields: Any) -> str:
+        """Serialize prompt context as compact JSON, dropping empty fields to save tokens"""
+        return msgspec.json.encode(
+            {name: value for name, value in fields.items() if value}
+        ).decode()
@@ -1,14 +1,84 @@
 import os
 import json
 import logging
+import re
+import orjson
 import requests
+import threading
 import time
-from typing import Dict, Any, Optional
-from google.auth import default
-from google.auth.transport.requests import Request
+from datetime import datetime, timezone
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Any, Optional, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
+# Base64 characters decoded per write when saving audio (a multiple of 4)
+BASE64_WINDOW = 64 * 1024
+
+# Lyria request body around the prompt: one 30-second WAV clip, temperature 0.7, no fixed seed
+_PAYLOAD_PREFIX = b'{"instances":[{"prompt":'
+_PAYLOAD_SUFFIX = b',"duration":30,"format":"wav"}],"parameters":{"temperature":0.7,"seed":null}}'
+
+# Access tokens are renewed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+# One set of credentials per process, refreshed by a background timer so requests never
+# wait on a token refresh; every LyriaService instance reads the same token
+_credentials = None
+_credentials_lock = threading.Lock()
+
+def _schedule_refresh(delay: Optional[float] = None) -> None:
+    """Start a timer that refreshes the shared credentials shortly before they expire"""
+    if delay is None:
+        expiry = _credentials.expiry
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth expiry is naive UTC
+        delay = (expiry - now).total_seconds() - TOKEN_REFRESH_MARGIN if expiry else 3000
+    
+    timer = threading.Timer(max(delay, 60), _refresh_credentials)
+    timer.daemon = True
+    timer.start()
+
+def _refresh_credentials() -> None:
+    """Refresh the shared credentials and schedule the next refresh ahead of expiry"""
+    from google.auth.transport.requests import Request
+    
+    try:
+        with _credentials_lock:
+            _credentials.refresh(Request())
+    except Exception as e:
+        logger.error(f"Lyria token refresh failed: {e}")
+        _schedule_refresh(60)
+        return
+    _schedule_refresh()
+
+def _ensure_fresh(credentials) -> None:
+    """Refresh inline if the timer hasn't kept the token valid (e.g. no timer thread after a fork)"""
+    from google.auth.transport.requests import Request
+    
+    if credentials.valid:
+        return
+    with _credentials_lock:
+        if not credentials.valid:
+            credentials.refresh(Request())
+
+def _get_credentials():
+    """Load default credentials on first use and start the background refresh"""
+    # google.auth is imported here so workers with Lyria disabled never load it
+    from google.auth import default
+    from google.auth.transport.requests import Request
+    
+    global _credentials
+    with _credentials_lock:
+        if _credentials is not None:
+            return _credentials
+        credentials, _ = default()
+        credentials.refresh(Request())
+        _credentials = credentials
+    _schedule_refresh()
+    return _credentials
+
 class LyriaService:
     """Service for generating 30-second music clips using Google Lyria on Vertex AI"""
     
@@ -16,7 +86,15 @@ class LyriaService:
         self.project_id = os.environ.get('GOOGLE_CLOUD_PROJECT')
         self.location = os.environ.get('VERTEX_AI_LOCATION', 'us-central1')
         self.credentials = None
-        self.access_token = None
+        self.url = f"https://{self.location}-aiplatform.googleapis.com/v1/projects/{self.project_id}/locations/{self.location}/publishers/google/models/lyria-2:predict"
+        
+        # Keep-alive session so each generation skips the TCP and TLS handshake
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        ))
         
         if not self.project_id:
             logger.warning("GOOGLE_CLOUD_PROJECT not found in environment variables")
@@ -24,18 +102,19 @@ class LyriaService:
             
         try:
             # Get default credentials
-            self.credentials, _ = default()
-            self._refresh_token()
+            self.credentials = _get_credentials()
             logger.info("Lyria service initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Lyria service: {e}")
             self.credentials = None
     
-    def _refresh_token(self):
-        """Refresh the access token"""
-        if self.credentials:
-            self.credentials.refresh(Request())
-            self.access_token = self.credentials.token
+    @property
+    def access_token(self) -> Optional[str]:
+        """Current access token, kept fresh by the background refresh"""
+        if not self.credentials:
+            return None
+        _ensure_fresh(self.credentials)
+        return self.credentials.token
     
     def generate_music(self, prompt: str, session_id: str) -> Dict[str, Any]:
         """Generate a 30-second music clip using Lyria"""
@@ -46,41 +125,23 @@ class LyriaService:
                     'error': 'Lyria service not properly configured'
                 }
             
-            # Refresh token if needed
-            if self.credentials.expired:
-                self._refresh_token()
-            
             # Prepare the request
-            url = f"https://{self.location}-aiplatform.googleapis.com/v1/projects/{self.project_id}/locations/{self.location}/publishers/google/models/lyria-2:predict"
-            
             headers = {
                 'Authorization': f'Bearer {self.access_token}',
                 'Content-Type': 'application/json'
             }
             
-            # Lyria request payload
-            payload = {
-                "instances": [
-                    {
-                        "prompt": prompt,
-                        "duration": 30,  # 30 seconds
-                        "format": "wav"
-                    }
-                ],
-                "parameters": {
-                    "temperature": 0.7,
-                    "seed": None  # For reproducibility, can be set to a specific value
-                }
-            }
+            # Only the prompt varies, so it is spliced into the pre-serialized request body
+            body = _PAYLOAD_PREFIX + orjson.dumps(prompt) + _PAYLOAD_SUFFIX
             
             logger.info(f"Generating music with Lyria for session {session_id}")
             logger.info(f"Prompt: {prompt}")
             
             # Make the request
-            response = requests.post(url, headers=headers, json=payload, timeout=120)
+            response = self._session.post(self.url, headers=headers, data=body, timeout=120)
             
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 
                 # Extract the audio data from the response
                 if 'predictions' in result and len(result['predictions']) > 0:
@@ -136,10 +197,12 @@ class LyriaService:
             filename = f"lyria_music_{session_id}_{int(time.time())}.wav"
             filepath = os.path.join(output_dir, filename)
             
-            # Decode and save the audio data
-            audio_bytes = base64.b64decode(audio_data)
+            # Decode and save the audio data in 64 KB windows so the whole WAV is never held
+            # in memory a second time; windows are multiples of 4 so each decodes on its own
             with open(filepath, 'wb') as f:
-                f.write(audio_bytes)
+                for start in range(0, len(audio_data), BASE64_WINDOW):
+                    chunk = audio_data[start:start + BASE64_WINDOW]
+                    f.write(base64.b64decode(chunk + '=' * (-len(chunk) % 4)))
             
             logger.info(f"Saved Lyria audio file: {filepath}")
             return filepath
@@ -153,54 +216,70 @@ class LyriaService:
         try:
             music_prefs = preferences.get('music_preferences', {})
             
-            # Build enhanced prompt
-            enhanced_parts = []
-            
-            # Add genre if specified
-            genre = music_prefs.get('genre')
-            if genre:
-                enhanced_parts.append(f"{genre} music")
-            
-            # Add mood/energy
-            mood = music_prefs.get('mood')
-            if mood:
-                enhanced_parts.append(f"{mood} mood")
-            
-            # Add tempo
-            tempo = music_prefs.get('tempo')
-            if tempo:
-                enhanced_parts.append(f"{tempo} tempo")
-            
-            # Add instruments if specified
+            # Lists become tuples so they can key the cache; the join happens only on a miss
             instruments = music_prefs.get('instruments')
-            if instruments:
-                if isinstance(instruments, list):
-                    instruments_str = ', '.join(instruments)
-                else:
-                    instruments_str = str(instruments)
-                enhanced_parts.append(f"featuring {instruments_str}")
-            
-            # Combine with user prompt
-            if enhanced_parts:
-                if user_prompt:
-                    enhanced_prompt = f"{user_prompt}, {', '.join(enhanced_parts)}"
-                else:
-                    enhanced_prompt = ', '.join(enhanced_parts)
-            else:
-                enhanced_prompt = user_prompt or "instrumental music"
-            
-            # Ensure it's suitable for Lyria (instrumental only)
-            if "vocal" in enhanced_prompt.lower() or "singing" in enhanced_prompt.lower():
-                enhanced_prompt = enhanced_prompt.replace("vocal", "instrumental")
-                enhanced_prompt = enhanced_prompt.replace("singing", "melodic")
+            if isinstance(instruments, list):
+                instruments = tuple(instruments)
+            elif instruments:
+                instruments = str(instruments)
             
-            # Add instrumental specification if not present
-            if "instrumental" not in enhanced_prompt.lower():
-                enhanced_prompt += ", instrumental"
+            enhanced_prompt = build_lyria_prompt(
+                user_prompt,
+                music_prefs.get('genre'),
+                music_prefs.get('mood'),
+                music_prefs.get('tempo'),
+                instruments or None
+            )
             
             logger.info(f"Enhanced prompt for Lyria: {enhanced_prompt}")
             return enhanced_prompt
             
         except Exception as e:
             logger.error(f"Error enhancing prompt: {e}")
-            return user_prompt or "instrumental music"
\ No newline at end of file
+            return user_prompt or "instrumental music"
+
+# Lyria only produces instrumentals, so vocal wording is swapped for these
+_VOCAL_REPLACEMENTS = {'vocal': 'instrumental', 'vocals': 'instrumental', 'singing': 'melodic'}
+_VOCAL_WORDS = re.compile(r'\b(vocals?|singing)\b', re.I)
+_INSTRUMENTAL = re.compile(r'instrumental', re.I)
+
+
+@lru_cache(maxsize=1024)
+def build_lyria_prompt(
+    user_prompt: str,
+    genre: Optional[str],
+    mood: Optional[str],
+    tempo: Optional[str],
+    instruments: Union[Tuple[str, ...], str, None],
+) -> str:
+    """Build the instrumental Lyria prompt; memoized since regenerations reuse the same preferences"""
+    enhanced_parts = []
+    
+    if genre:
+        enhanced_parts.append(f"{genre} music")
+    if mood:
+        enhanced_parts.append(f"{mood} mood")
+    if tempo:
+        enhanced_parts.append(f"{tempo} tempo")
+    if instruments:
+        if isinstance(instruments, tuple):
+            instruments = ', '.join(instruments)
+        enhanced_parts.append(f"featuring {instruments}")
+    
+    # Combine with user prompt
+    if enhanced_parts:
+        if user_prompt:
+            enhanced_prompt = f"{user_prompt}, {', '.join(enhanced_parts)}"
+        else:
+            enhanced_prompt = ', '.join(enhanced_parts)
+    else:
+        enhanced_prompt = user_prompt or "instrumental music"
+    
+    # Ensure it's suitable for Lyria (instrumental only)
+    enhanced_prompt = _VOCAL_WORDS.sub(lambda match: _VOCAL_REPLACEMENTS[match.group(1).lower()], enhanced_prompt)
+    
+    # Add instrumental specification if not present
+    if not _INSTRUMENTAL.search(enhanced_prompt):
+        enhanced_prompt += ", instrumental"
+    
+    return enhanced_prompt
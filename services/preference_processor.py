@@ -1,173 +1,233 @@
 import json
-from datetime import datetime
-from typing import Dict, Any, List
+import time
+from functools import lru_cache
+from dataclasses import dataclass, field, fields
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Tuple
+
+def _utc_timestamp() -> str:
+    """Current UTC time in datetime.utcnow().isoformat() form, without building a datetime"""
+    seconds, nanoseconds = divmod(time.time_ns(), 1_000_000_000)
+    return f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))}.{nanoseconds // 1000:06d}"
+
+
+# Suno BPM ranges for the user-facing tempo choices
+_SUNO_TEMPO_RANGES = {
+    'slow': '60-80',
+    'medium': '80-120',
+    'fast': '120-160',
+    'very_fast': '160+'
+}
+
+
+@dataclass(frozen=True, slots=True)
+class RawPreferences:
+    """Every field the processors read from the raw input, with its default filled in"""
+    genre: Any = 'pop'
+    mood: Any = 'upbeat'
+    tempo: Any = 'medium'
+    duration: Any = 60
+    instruments: Any = field(default_factory=list)
+    vocal_style: Any = 'none'
+    # Suno falls back to an instrumental when no vocal style was chosen
+    suno_vocal_style: Any = 'instrumental'
+    lyrics_theme: Any = ''
+    energy_level: Any = 'medium'
+    visual_style: Any = 'modern'
+    color_scheme: Any = 'vibrant'
+    animation_style: Any = 'smooth'
+    themes: Any = field(default_factory=list)
+    aspect_ratio: Any = '16:9'
+    resolution: Any = '1080p'
+    effects: Any = field(default_factory=list)
+    transition_style: Any = 'fade'
+    project_name: Any = ''
+    description: Any = ''
+    target_audience: Any = 'general'
+    usage_purpose: Any = 'personal'
+    quality_priority: Any = 'balanced'
+
+
+_RAW_FIELDS = frozenset(raw_field.name for raw_field in fields(RawPreferences)) - {'suno_vocal_style'}
+
+
+def _extract(data: Dict[str, Any]) -> RawPreferences:
+    """Read every field the processors use from the raw input once"""
+    values = {name: data[name] for name in _RAW_FIELDS if name in data}
+    if 'vocal_style' in data:
+        values['suno_vocal_style'] = data['vocal_style']
+    return RawPreferences(**values)
+
+# Preset configurations, shared read-only by every processor instance
+_PRESETS = MappingProxyType({
+    name: MappingProxyType(preset) for name, preset in {
+        'energetic_pop': {
+            'genre': 'pop',
+            'mood': 'upbeat',
+            'tempo': 'fast',
+            'energy_level': 'high',
+            'visual_style': 'modern',
+            'color_scheme': 'vibrant',
+            'animation_style': 'dynamic'
+        },
+        'chill_lofi': {
+            'genre': 'lofi',
+            'mood': 'relaxed',
+            'tempo': 'slow',
+            'energy_level': 'low',
+            'visual_style': 'minimal',
+            'color_scheme': 'pastel',
+            'animation_style': 'smooth'
+        },
+        'rock_anthem': {
+            'genre': 'rock',
+            'mood': 'powerful',
+            'tempo': 'fast',
+            'energy_level': 'high',
+            'visual_style': 'bold',
+            'color_scheme': 'dark',
+            'animation_style': 'intense'
+        },
+        'ambient_electronic': {
+            'genre': 'electronic',
+            'mood': 'atmospheric',
+            'tempo': 'medium',
+            'energy_level': 'medium',
+            'visual_style': 'futuristic',
+            'color_scheme': 'neon',
+            'animation_style': 'flowing'
+        }
+    }.items()
+})
 
 class PreferenceProcessor:
     """Process and structure user preferences for music and video generation"""
     
     def __init__(self):
-        self.presets = self._load_presets()
+        self.presets = _PRESETS
     
     def process_preferences(self, raw_data: Dict[str, Any], session_id: str) -> Dict[str, Any]:
         """Process raw user input into structured preferences"""
+        prefs = _extract(raw_data)
         
         processed = {
             'session_id': session_id,
-            'timestamp': datetime.utcnow().isoformat(),
-            'music_preferences': self._process_music_preferences(raw_data),
-            'video_preferences': self._process_video_preferences(raw_data),
-            'general_preferences': self._process_general_preferences(raw_data),
-            'suno_parameters': self._generate_suno_parameters(raw_data),
-            'runware_parameters': self._generate_runware_parameters(raw_data)
+            'timestamp': _utc_timestamp(),
+            'music_preferences': self._process_music_preferences(prefs),
+            'video_preferences': self._process_video_preferences(prefs),
+            'general_preferences': self._process_general_preferences(prefs),
+            'suno_parameters': self._generate_suno_parameters(prefs),
+            'runware_parameters': self._generate_runware_parameters(prefs)
         }
         
         return processed
     
-    def _process_music_preferences(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _process_music_preferences(self, prefs: RawPreferences) -> Dict[str, Any]:
         """Process music-related preferences"""
         return {
-            'genre': data.get('genre', 'pop'),
-            'mood': data.get('mood', 'upbeat'),
-            'tempo': data.get('tempo', 'medium'),
-            'duration': int(data.get('duration', 60)),
-            'instruments': data.get('instruments', []),
-            'vocal_style': data.get('vocal_style', 'none'),
-            'lyrics_theme': data.get('lyrics_theme', ''),
-            'energy_level': data.get('energy_level', 'medium')
+            'genre': prefs.genre,
+            'mood': prefs.mood,
+            'tempo': prefs.tempo,
+            'duration': int(prefs.duration),
+            'instruments': prefs.instruments,
+            'vocal_style': prefs.vocal_style,
+            'lyrics_theme': prefs.lyrics_theme,
+            'energy_level': prefs.energy_level
         }
     
-    def _process_video_preferences(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _process_video_preferences(self, prefs: RawPreferences) -> Dict[str, Any]:
         """Process video-related preferences"""
         return {
-            'visual_style': data.get('visual_style', 'modern'),
-            'color_scheme': data.get('color_scheme', 'vibrant'),
-            'animation_style': data.get('animation_style', 'smooth'),
-            'themes': data.get('themes', []),
-            'aspect_ratio': data.get('aspect_ratio', '16:9'),
-            'resolution': data.get('resolution', '1080p'),
-            'effects': data.get('effects', []),
-            'transition_style': data.get('transition_style', 'fade')
+            'visual_style': prefs.visual_style,
+            'color_scheme': prefs.color_scheme,
+            'animation_style': prefs.animation_style,
+            'themes': prefs.themes,
+            'aspect_ratio': prefs.aspect_ratio,
+            'resolution': prefs.resolution,
+            'effects': prefs.effects,
+            'transition_style': prefs.transition_style
         }
     
-    def _process_general_preferences(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _process_general_preferences(self, prefs: RawPreferences) -> Dict[str, Any]:
         """Process general preferences"""
         return {
-            'project_name': data.get('project_name', ''),
-            'description': data.get('description', ''),
-            'target_audience': data.get('target_audience', 'general'),
-            'usage_purpose': data.get('usage_purpose', 'personal'),
-            'quality_priority': data.get('quality_priority', 'balanced')
+            'project_name': prefs.project_name,
+            'description': prefs.description,
+            'target_audience': prefs.target_audience,
+            'usage_purpose': prefs.usage_purpose,
+            'quality_priority': prefs.quality_priority
         }
     
-    def _generate_suno_parameters(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _generate_suno_parameters(self, prefs: RawPreferences) -> Dict[str, Any]:
         """Generate parameters for Suno API"""
-        genre = data.get('genre', 'pop')
-        mood = data.get('mood', 'upbeat')
-        tempo = data.get('tempo', 'medium')
-        
-        # Map user-friendly terms to Suno parameters
-        tempo_mapping = {
-            'slow': '60-80',
-            'medium': '80-120',
-            'fast': '120-160',
-            'very_fast': '160+'
-        }
-        
         return {
-            'genre': genre,
-            'mood': mood,
-            'tempo': tempo_mapping.get(tempo, '80-120'),
-            'duration': data.get('duration', 60),
-            'style': f"{genre} {mood}",
-            'prompt': self._generate_music_prompt(data),
-            'vocal_style': data.get('vocal_style', 'instrumental')
+            'genre': prefs.genre,
+            'mood': prefs.mood,
+            'tempo': _SUNO_TEMPO_RANGES.get(prefs.tempo, '80-120'),
+            'duration': prefs.duration,
+            'style': f"{prefs.genre} {prefs.mood}",
+            'prompt': self._generate_music_prompt(prefs),
+            'vocal_style': prefs.suno_vocal_style
         }
     
-    def _generate_runware_parameters(self, data: Dict[str, Any]) -> Dict[str, Any]:
+    def _generate_runware_parameters(self, prefs: RawPreferences) -> Dict[str, Any]:
         """Generate parameters for Runware API"""
         return {
-            'style': data.get('visual_style', 'modern'),
-            'color_palette': data.get('color_scheme', 'vibrant'),
-            'animation_type': data.get('animation_style', 'smooth'),
-            'themes': data.get('themes', []),
-            'resolution': data.get('resolution', '1080p'),
+            'style': prefs.visual_style,
+            'color_palette': prefs.color_scheme,
+            'animation_type': prefs.animation_style,
+            'themes': prefs.themes,
+            'resolution': prefs.resolution,
             'fps': 30,
-            'duration': data.get('duration', 60),
-            'prompt': self._generate_video_prompt(data)
+            'duration': prefs.duration,
+            'prompt': self._generate_video_prompt(prefs)
         }
     
-    def _generate_music_prompt(self, data: Dict[str, Any]) -> str:
+    def _generate_music_prompt(self, prefs: RawPreferences) -> str:
         """Generate a descriptive prompt for music generation"""
-        genre = data.get('genre', 'pop')
-        mood = data.get('mood', 'upbeat')
-        tempo = data.get('tempo', 'medium')
-        energy = data.get('energy_level', 'medium')
-        
-        prompt = f"Create a {tempo} tempo {genre} track with a {mood} mood and {energy} energy level"
-        
-        if data.get('instruments'):
-            instruments = ', '.join(data['instruments'])
-            prompt += f", featuring {instruments}"
-        
-        if data.get('lyrics_theme'):
-            prompt += f", with lyrics about {data['lyrics_theme']}"
-        
-        return prompt
+        return _build_music_prompt(
+            prefs.genre,
+            prefs.mood,
+            prefs.tempo,
+            prefs.energy_level,
+            tuple(prefs.instruments or ()),
+            prefs.lyrics_theme or ''
+        )
     
-    def _generate_video_prompt(self, data: Dict[str, Any]) -> str:
+    def _generate_video_prompt(self, prefs: RawPreferences) -> str:
         """Generate a descriptive prompt for video generation"""
-        style = data.get('visual_style', 'modern')
-        colors = data.get('color_scheme', 'vibrant')
-        
-        prompt = f"Create a {style} visual style video with {colors} colors"
-        
-        if data.get('themes'):
-            themes = ', '.join(data['themes'])
-            prompt += f", incorporating themes of {themes}"
-        
-        return prompt
+        return _build_video_prompt(
+            prefs.visual_style,
+            prefs.color_scheme,
+            tuple(prefs.themes or ())
+        )
     
-    def _load_presets(self) -> Dict[str, Any]:
-        """Load preset configurations"""
-        return {
-            'energetic_pop': {
-                'genre': 'pop',
-                'mood': 'upbeat',
-                'tempo': 'fast',
-                'energy_level': 'high',
-                'visual_style': 'modern',
-                'color_scheme': 'vibrant',
-                'animation_style': 'dynamic'
-            },
-            'chill_lofi': {
-                'genre': 'lofi',
-                'mood': 'relaxed',
-                'tempo': 'slow',
-                'energy_level': 'low',
-                'visual_style': 'minimal',
-                'color_scheme': 'pastel',
-                'animation_style': 'smooth'
-            },
-            'rock_anthem': {
-                'genre': 'rock',
-                'mood': 'powerful',
-                'tempo': 'fast',
-                'energy_level': 'high',
-                'visual_style': 'bold',
-                'color_scheme': 'dark',
-                'animation_style': 'intense'
-            },
-            'ambient_electronic': {
-                'genre': 'electronic',
-                'mood': 'atmospheric',
-                'tempo': 'medium',
-                'energy_level': 'medium',
-                'visual_style': 'futuristic',
-                'color_scheme': 'neon',
-                'animation_style': 'flowing'
-            }
-        }
-    
-    def get_presets(self) -> Dict[str, Any]:
+    def get_presets(self) -> Mapping[str, Any]:
         """Return available presets"""
-        return self.presets
+        return _PRESETS
+
+
+@lru_cache(maxsize=1024)
+def _build_music_prompt(genre: str, mood: str, tempo: str, energy: str,
+                        instruments: Tuple[str, ...], lyrics_theme: str) -> str:
+    """Music prompt text; memoized since resubmits and retries reuse the same preferences"""
+    prompt = f"Create a {tempo} tempo {genre} track with a {mood} mood and {energy} energy level"
+    
+    if instruments:
+        prompt += f", featuring {', '.join(instruments)}"
+    
+    if lyrics_theme:
+        prompt += f", with lyrics about {lyrics_theme}"
+    
+    return prompt
+
+
+@lru_cache(maxsize=1024)
+def _build_video_prompt(style: str, colors: str, themes: Tuple[str, ...]) -> str:
+    """Video prompt text; memoized like _build_music_prompt"""
+    prompt = f"Create a {style} visual style video with {colors} colors"
+    
+    if themes:
+        prompt += f", incorporating themes of {', '.join(themes)}"
+    
+    return prompt
@@ -0,0 +1,226 @@
+import logging
+import os
+import time
+import msgspec
+import redis
+from redis.exceptions import WatchError
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Size the shared pool to worker concurrency times the Redis calls a task has in flight at once
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 100))
+
+_redis_client: Optional[redis.Redis] = None
+
+def get_redis() -> redis.Redis:
+    """Process-wide Redis client on a bounded pool; callers wait up to 5s for a free connection"""
+    global _redis_client
+    if _redis_client is None:
+        pool = redis.BlockingConnectionPool.from_url(
+            os.environ.get('REDIS_URL', 'redis://localhost:6379'),
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=5
+        )
+        _redis_client = redis.Redis(connection_pool=pool)
+    return _redis_client
+
+_KEY_PREFIX = "preferences:"
+
+# Default for SessionManager's client: distinguishes "use the shared pool" from an
+# explicit None, which selects the in-memory fallback
+_SHARED_POOL = object()
+
+# Attempts at an optimistic read-modify-write before giving up on concurrent writers
+UPDATE_ATTEMPTS = 3
+
+def decode_preferences(stored_data: bytes) -> Dict[str, Any]:
+    """Decode stored preferences: msgpack, or JSON for keys written before the switch"""
+    if stored_data[:1] == b'{':
+        return msgspec.json.decode(stored_data)
+    return msgspec.msgpack.decode(stored_data)
+
+class SessionManager:
+    """Manage user sessions and preference storage"""
+    
+    def __init__(self, redis_client: Optional[redis.Redis] = _SHARED_POOL):
+        # Without a client argument, every SessionManager shares the process-wide pool;
+        # passing None keeps preferences in memory instead
+        self.redis_client = get_redis() if redis_client is _SHARED_POOL else redis_client
+        self.session_expiry = 3600  # 1 hour in seconds
+        self.in_memory_store = {}  # Fallback for when Redis is not available
+    
+    @staticmethod
+    def _key(session_id: str) -> str:
+        """Redis key holding a session's preferences"""
+        return _KEY_PREFIX + session_id
+    
+    def store_preferences(self, session_id: str, preferences: Dict[str, Any]) -> bool:
+        """Store user preferences in Redis or memory, restarting the session expiry"""
+        # Add timestamp
+        preferences['stored_at'] = int(time.time())
+        
+        if not self.redis_client:
+            # Fallback to in-memory storage
+            self.in_memory_store[session_id] = {
+                'data': preferences,
+                'expires_at': time.time() + self.session_expiry
+            }
+            logger.info("Preferences stored in memory for session: %s", session_id)
+            return True
+        
+        # Store in Redis with expiration
+        data = msgspec.msgpack.encode(preferences)
+        try:
+            self.redis_client.setex(self._key(session_id), self.session_expiry, data)
+        except redis.RedisError as e:
+            logger.error("Error storing preferences: %s", e)
+            return False
+        
+        logger.info("Preferences stored in Redis for session: %s", session_id)
+        return True
+    
+    def get_preferences(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieve user preferences from Redis or memory"""
+        if not self.redis_client:
+            # Fallback to in-memory storage
+            stored_item = self.in_memory_store.get(session_id)
+            if stored_item is None:
+                return None
+            
+            # Check if expired
+            if time.time() > stored_item['expires_at']:
+                del self.in_memory_store[session_id]
+                return None
+            
+            logger.info("Preferences retrieved from memory for session: %s", session_id)
+            return stored_item['data']
+        
+        try:
+            stored_data = self.redis_client.get(self._key(session_id))
+        except redis.RedisError as e:
+            logger.error("Error retrieving preferences: %s", e)
+            return None
+        
+        if not stored_data:
+            return None
+        
+        logger.info("Preferences retrieved from Redis for session: %s", session_id)
+        return decode_preferences(stored_data)
+    
+    def get_many_preferences(self, session_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Retrieve preferences for several sessions in one round-trip; None where missing"""
+        if not self.redis_client:
+            return [self.get_preferences(session_id) for session_id in session_ids]
+        
+        try:
+            stored = self.redis_client.mget([self._key(session_id) for session_id in session_ids])
+        except redis.RedisError as e:
+            logger.error("Error retrieving preferences: %s", e)
+            return [None] * len(session_ids)
+        
+        return [decode_preferences(data) if data else None for data in stored]
+    
+    def store_many_preferences(self, preferences_by_session: Dict[str, Dict[str, Any]]) -> bool:
+        """Store preferences for several sessions in one pipelined round-trip"""
+        if not self.redis_client:
+            return all(self.store_preferences(session_id, preferences)
+                       for session_id, preferences in preferences_by_session.items())
+        
+        stored_at = int(time.time())
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            for session_id, preferences in preferences_by_session.items():
+                preferences['stored_at'] = stored_at
+                pipe.setex(self._key(session_id), self.session_expiry, msgspec.msgpack.encode(preferences))
+            try:
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.error("Error storing preferences: %s", e)
+                return False
+        
+        logger.info("Preferences stored in Redis for %s sessions", len(preferences_by_session))
+        return True
+    
+    def update_preferences(self, session_id: str, updates: Dict[str, Any]) -> bool:
+        """Update existing preferences"""
+        if not self.redis_client:
+            existing_prefs = self.get_preferences(session_id)
+            if not existing_prefs:
+                return False
+            
+            # Merge updates
+            existing_prefs.update(updates)
+            existing_prefs['updated_at'] = int(time.time())
+            
+            return self.store_preferences(session_id, existing_prefs)
+        
+        # Read, merge and write back in one WATCH/MULTI transaction so a concurrent
+        # update can't be lost; retry if another writer got in between
+        key = self._key(session_id)
+        try:
+            for _ in range(UPDATE_ATTEMPTS):
+                with self.redis_client.pipeline(transaction=True) as pipe:
+                    try:
+                        pipe.watch(key)
+                        stored_data = pipe.get(key)
+                        if not stored_data:
+                            return False
+                        
+                        existing_prefs = decode_preferences(stored_data)
+                        existing_prefs.update(updates)
+                        existing_prefs['updated_at'] = existing_prefs['stored_at'] = int(time.time())
+                        
+                        pipe.multi()
+                        pipe.setex(key, self.session_expiry, msgspec.msgpack.encode(existing_prefs))
+                        pipe.execute()
+                        return True
+                    except WatchError:
+                        continue
+        except redis.RedisError as e:
+            logger.error("Error updating preferences: %s", e)
+            return False
+        
+        logger.warning("Preferences for session %s changed during every update attempt", session_id)
+        return False
+    
+    def delete_preferences(self, session_id: str) -> bool:
+        """Delete user preferences"""
+        if not self.redis_client:
+            # Fallback to in-memory storage
+            if self.in_memory_store.pop(session_id, None) is None:
+                return False
+            logger.info("Preferences deleted from memory for session: %s", session_id)
+            return True
+        
+        try:
+            result = self.redis_client.delete(self._key(session_id))
+        except redis.RedisError as e:
+            logger.error("Error deleting preferences: %s", e)
+            return False
+        
+        logger.info("Preferences deleted from Redis for session: %s", session_id)
+        return result > 0
+    
+    def touch_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Read preferences and restart their expiry in one round-trip; None if missing.
+        
+        Writes don't need this: store_preferences already resets the expiry clock.
+        """
+        if not self.redis_client:
+            # Fallback to in-memory storage
+            preferences = self.get_preferences(session_id)
+            if preferences is not None:
+                self.in_memory_store[session_id]['expires_at'] = time.time() + self.session_expiry
+            return preferences
+        
+        key = self._key(session_id)
+        try:
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.expire(key, self.session_expiry)
+                stored_data, _ = pipe.execute()
+        except redis.RedisError as e:
+            logger.error("Error extending session: %s", e)
+            return None
+        
+        return decode_preferences(stored_data) if stored_data else None
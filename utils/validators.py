@@ -1,37 +1,64 @@
 import validators
-from typing import Dict, Any, List
+from typing import Dict, Any, FrozenSet, Iterator, Tuple
+
+# Allowed values, shared by every validator; membership checks are hash lookups
+_VALID_GENRES: FrozenSet[str] = frozenset({
+    'pop', 'rock', 'electronic', 'hip-hop', 'jazz', 'classical',
+    'country', 'folk', 'reggae', 'blues', 'funk', 'lofi', 'ambient'
+})
+
+_VALID_MOODS: FrozenSet[str] = frozenset({
+    'upbeat', 'relaxed', 'energetic', 'melancholic', 'happy',
+    'sad', 'angry', 'peaceful', 'dramatic', 'mysterious', 'romantic'
+})
+
+_VALID_TEMPOS: FrozenSet[str] = frozenset({'slow', 'medium', 'fast', 'very_fast'})
+
+_VALID_VISUAL_STYLES: FrozenSet[str] = frozenset({
+    'modern', 'vintage', 'minimal', 'bold', 'abstract',
+    'realistic', 'cartoon', 'futuristic', 'retro'
+})
+
+_VALID_COLOR_SCHEMES: FrozenSet[str] = frozenset({
+    'vibrant', 'pastel', 'dark', 'monochrome', 'neon',
+    'warm', 'cool', 'earth_tones', 'rainbow'
+})
+
+_VALID_RESOLUTIONS: FrozenSet[str] = frozenset({'720p', '1080p', '4k'})
+_VALID_ASPECT_RATIOS: FrozenSet[str] = frozenset({'16:9', '9:16', '1:1', '4:3'})
+
+# Longer instrument lists are rejected before they reach prompt building
+MAX_INSTRUMENTS = 32
+
+# (field, allowed values, error message template) for every whitelisted field
+_WHITELIST_FIELDS: Tuple[Tuple[str, FrozenSet[str], str], ...] = (
+    ('genre', _VALID_GENRES, "Invalid genre: {}"),
+    ('mood', _VALID_MOODS, "Invalid mood: {}"),
+    ('tempo', _VALID_TEMPOS, "Invalid tempo: {}"),
+    ('visual_style', _VALID_VISUAL_STYLES, "Invalid visual style: {}"),
+    ('color_scheme', _VALID_COLOR_SCHEMES, "Invalid color scheme: {}"),
+    ('resolution', _VALID_RESOLUTIONS, "Invalid resolution: {}"),
+    ('aspect_ratio', _VALID_ASPECT_RATIOS, "Invalid aspect ratio: {}"),
+)
+
+def _is_allowed(value: Any, allowed: FrozenSet[str]) -> bool:
+    """Membership test that treats unhashable JSON values (lists, objects) as not allowed"""
+    return isinstance(value, str) and value in allowed
 
 class PreferenceValidator:
     """Validate user input preferences"""
     
-    def __init__(self):
-        self.valid_genres = [
-            'pop', 'rock', 'electronic', 'hip-hop', 'jazz', 'classical',
-            'country', 'folk', 'reggae', 'blues', 'funk', 'lofi', 'ambient'
-        ]
-        
-        self.valid_moods = [
-            'upbeat', 'relaxed', 'energetic', 'melancholic', 'happy',
-            'sad', 'angry', 'peaceful', 'dramatic', 'mysterious', 'romantic'
-        ]
-        
-        self.valid_tempos = ['slow', 'medium', 'fast', 'very_fast']
-        
-        self.valid_visual_styles = [
-            'modern', 'vintage', 'minimal', 'bold', 'abstract',
-            'realistic', 'cartoon', 'futuristic', 'retro'
-        ]
-        
-        self.valid_color_schemes = [
-            'vibrant', 'pastel', 'dark', 'monochrome', 'neon',
-            'warm', 'cool', 'earth_tones', 'rainbow'
-        ]
-        
-        self.valid_resolutions = ['720p', '1080p', '4k']
-        self.valid_aspect_ratios = ['16:9', '9:16', '1:1', '4:3']
+    # Public names for the whitelists, e.g. to list the choices in a form
+    valid_genres = _VALID_GENRES
+    valid_moods = _VALID_MOODS
+    valid_tempos = _VALID_TEMPOS
+    valid_visual_styles = _VALID_VISUAL_STYLES
+    valid_color_schemes = _VALID_COLOR_SCHEMES
+    valid_resolutions = _VALID_RESOLUTIONS
+    valid_aspect_ratios = _VALID_ASPECT_RATIOS
     
-    def validate_preferences(self, data: Dict[str, Any]) -> Dict[str, Any]:
-        """Validate all user preferences"""
+    def validate_preferences(self, data: Dict[str, Any], fail_fast: bool = False) -> Dict[str, Any]:
+        """Validate all user preferences; with fail_fast, stop at the first error"""
         errors = []
         
         # Validate required fields
@@ -39,38 +66,23 @@ class PreferenceValidator:
             errors.append("No data provided")
             return {'valid': False, 'errors': errors}
         
-        # Validate music preferences
-        errors.extend(self._validate_music_preferences(data))
-        
-        # Validate video preferences
-        errors.extend(self._validate_video_preferences(data))
-        
-        # Validate general preferences
-        errors.extend(self._validate_general_preferences(data))
+        for error in self._errors(data):
+            errors.append(error)
+            if fail_fast:
+                break
         
         return {
             'valid': len(errors) == 0,
             'errors': errors
         }
     
-    def _validate_music_preferences(self, data: Dict[str, Any]) -> List[str]:
-        """Validate music-related preferences"""
-        errors = []
-        
-        # Genre validation
-        genre = data.get('genre')
-        if genre and genre not in self.valid_genres:
-            errors.append(f"Invalid genre: {genre}")
-        
-        # Mood validation
-        mood = data.get('mood')
-        if mood and mood not in self.valid_moods:
-            errors.append(f"Invalid mood: {mood}")
-        
-        # Tempo validation
-        tempo = data.get('tempo')
-        if tempo and tempo not in self.valid_tempos:
-            errors.append(f"Invalid tempo: {tempo}")
+    def _errors(self, data: Dict[str, Any]) -> Iterator[str]:
+        """Yield an error message for each invalid preference, in check order"""
+        # Whitelisted fields, checked in a single pass over the table
+        for field, allowed, template in _WHITELIST_FIELDS:
+            value = data.get(field)
+            if value and not _is_allowed(value, allowed):
+                yield template.format(value)
         
         # Duration validation
         duration = data.get('duration')
@@ -78,55 +90,21 @@ class PreferenceValidator:
             try:
                 duration = int(duration)
                 if duration < 10 or duration > 300:
-                    errors.append("Duration must be between 10 and 300 seconds")
+                    yield "Duration must be between 10 and 300 seconds"
             except (ValueError, TypeError):
-                errors.append("Duration must be a valid number")
+                yield "Duration must be a valid number"
         
         # Instruments validation
-        instruments = data.get('instruments', [])
+        instruments = data.get('instruments') or []
         if instruments and not isinstance(instruments, list):
-            errors.append("Instruments must be a list")
-        
-        return errors
-    
-    def _validate_video_preferences(self, data: Dict[str, Any]) -> List[str]:
-        """Validate video-related preferences"""
-        errors = []
-        
-        # Visual style validation
-        visual_style = data.get('visual_style')
-        if visual_style and visual_style not in self.valid_visual_styles:
-            errors.append(f"Invalid visual style: {visual_style}")
-        
-        # Color scheme validation
-        color_scheme = data.get('color_scheme')
-        if color_scheme and color_scheme not in self.valid_color_schemes:
-            errors.append(f"Invalid color scheme: {color_scheme}")
-        
-        # Resolution validation
-        resolution = data.get('resolution')
-        if resolution and resolution not in self.valid_resolutions:
-            errors.append(f"Invalid resolution: {resolution}")
-        
-        # Aspect ratio validation
-        aspect_ratio = data.get('aspect_ratio')
-        if aspect_ratio and aspect_ratio not in self.valid_aspect_ratios:
-            errors.append(f"Invalid aspect ratio: {aspect_ratio}")
-        
-        return errors
-    
-    def _validate_general_preferences(self, data: Dict[str, Any]) -> List[str]:
-        """Validate general preferences"""
-        errors = []
+            yield "Instruments must be a list"
+        elif len(instruments) > MAX_INSTRUMENTS:
+            yield f"No more than {MAX_INSTRUMENTS} instruments are allowed"
         
         # Project name validation
-        project_name = data.get('project_name', '')
-        if project_name and len(project_name) > 100:
-            errors.append("Project name must be less than 100 characters")
+        if len(data.get('project_name') or '') > 100:
+            yield "Project name must be less than 100 characters"
         
         # Description validation
-        description = data.get('description', '')
-        if description and len(description) > 500:
-            errors.append("Description must be less than 500 characters")
-        
-        return errors
+        if len(data.get('description') or '') > 500:
+            yield "Description must be less than 500 characters"
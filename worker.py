@@ -5,19 +5,39 @@ Celery worker for background tasks
 import os
 import sys
 import logging
+
+# prefork suits the CPU-bound video queue; eventlet suits I/O-only queues such as music_generation
+CELERY_POOL = os.environ.get('CELERY_POOL', 'prefork')
+
+if CELERY_POOL == 'eventlet':
+    # Patch sockets before Redis and HTTP clients are imported so their I/O yields
+    import eventlet
+    eventlet.monkey_patch()
+
 from celery_app import celery_app
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_WORKER_ARGV = (
+    'worker',
+    f'--loglevel={os.environ.get("LOG_LEVEL", "info")}',
+    # Each process's Redis pool is capped by REDIS_MAX_CONNECTIONS; keep it at least
+    # this concurrency times the Redis calls one task makes at once
+    f'--concurrency={celery_app.conf.worker_concurrency}',
+    f'--pool={CELERY_POOL}',
+    f'--queues={os.environ.get("CELERY_QUEUES", "music_generation,video_generation,celery")}',
+    '--prefetch-multiplier=1',
+)
+
+# Opt-in: skip the inter-worker gossip, mingle and heartbeat traffic that grows with the
+# number of workers. Off by default because heartbeats are how the cluster notices a dead worker
+if os.environ.get('CELERY_QUIET_WORKER', '').lower() in ('1', 'true', 'yes'):
+    _WORKER_ARGV += ('--without-gossip', '--without-mingle', '--without-heartbeat')
+
 if __name__ == '__main__':
     logger.info("Starting Celery worker for Quick Music Videos")
     
     # Start Celery worker
-    celery_app.worker_main([
-        'worker',
-        '--loglevel=info',
-        '--concurrency=2',
-        '--queues=music_generation,video_generation,celery'
-    ])
+    celery_app.worker_main(list(_WORKER_ARGV))